@@ -2,6 +2,13 @@
 """
 Lyrics word-level alignment using faster-whisper.
 Usage: python3 align_lyrics.py <audio_wav_path> <lyrics_txt_path> <output_json_path>
+       python3 align_lyrics.py --serve [--socket PATH]
+       python3 align_lyrics.py --client [--socket PATH] <audio_wav_path> <lyrics_txt_path> <output_json_path>
+
+--serve loads the Whisper model once and handles alignment requests over a
+unix socket; --client sends one request to a running server (and falls back
+to aligning in-process when no server is listening).  The socket and the
+connection key are handled by worker_socket.py.
 
 Strategy:
 1. Run faster-whisper with word-level timestamps
@@ -13,20 +20,46 @@ import sys
 import json
 import os
 import re
+from functools import lru_cache
+from multiprocessing import AuthenticationError
+
+import worker_socket
+from whisper_device import cpu_threads, pick_device, pin_thread_pools
+
+_NORM_RE = re.compile(r"[^a-z0-9']")
 
+# Socket path when --socket is not given; resolved lazily since the default
+# lives in a per-user directory that may need creating
+SOCKET_ENV = "ALIGN_LYRICS_SOCKET"
 
+
+@lru_cache(maxsize=8192)
 def normalize_word(w: str) -> str:
     """Strip punctuation and lowercase for matching."""
-    return re.sub(r"[^a-z0-9']", "", w.lower())
+    return _NORM_RE.sub("", w.lower())
 
 
-def align_lyrics(audio_path: str, lyrics_path: str, output_path: str) -> None:
+def load_model():
+    """Load the Whisper base model on the best available device (see whisper_device)."""
+    threads = cpu_threads()
+    # Before faster_whisper is imported, which loads OpenMP and BLAS
+    pin_thread_pools(threads)
     try:
         from faster_whisper import WhisperModel
     except ImportError:
         print("ERROR: faster-whisper not installed. Run: pip3 install faster-whisper", file=sys.stderr)
         sys.exit(1)
 
+    device, compute_type = pick_device()
+    print(f"[align_lyrics] Loading Whisper model (base, {device}/{compute_type})...")
+
+    # int8 weights: faster inference with lower memory usage on CPU and GPU
+    return WhisperModel("base", device=device, compute_type=compute_type,
+                        cpu_threads=threads)
+
+
+def align_lyrics(audio_path: str, lyrics_path: str, output_path: str, model=None) -> None:
+    """Align lyrics to audio; pass an already loaded model to skip loading."""
     print(f"[align_lyrics] Reading lyrics from: {lyrics_path}")
     with open(lyrics_path, "r", encoding="utf-8") as f:
         lyrics_text = f.read().strip()
@@ -35,10 +68,8 @@ def align_lyrics(audio_path: str, lyrics_path: str, output_path: str) -> None:
     lyrics_words = [w for w in re.split(r'\s+', lyrics_text) if w.strip()]
 
     print(f"[align_lyrics] Lyrics: {len(lyrics_words)} words")
-    print("[align_lyrics] Loading Whisper model (base)...")
-
-    # Use int8 quantization for faster CPU inference with lower memory usage
-    model = WhisperModel("base", device="cpu", compute_type="int8")
+    if model is None:
+        model = load_model()
 
     print(f"[align_lyrics] Transcribing: {audio_path}")
     segments_generator, _info = model.transcribe(
@@ -80,49 +111,76 @@ def align_lyrics(audio_path: str, lyrics_path: str, output_path: str) -> None:
     print(f"[align_lyrics] Saved to: {output_path}")
 
 
+# Alignment scores for _map_to_provided_lyrics
+MATCH_SCORE = 2      # normalized words are equal
+PARTIAL_SCORE = 1    # one normalized word contains the other
+MISMATCH_SCORE = -1  # words paired up but different
+GAP_SCORE = -1       # lyrics word without a Whisper word (or vice versa)
+
+
 def _map_to_provided_lyrics(lyrics_words: list, whisper_words: list) -> list:
     """
-    Map provided lyrics words to whisper timestamps using greedy alignment.
-    Uses normalized word matching with tolerance for transcription errors.
+    Map provided lyrics words to whisper timestamps with a global
+    (Needleman–Wunsch) alignment of the normalized word sequences.
+
+    Whisper words before the first / after the last lyrics word are skipped
+    for free.  The score matrix is built in one vectorized comparison and each
+    DP row is filled with NumPy (the left-neighbour dependency is resolved
+    with a running maximum), so only the traceback runs in Python.
+
+    Lyrics words aligned to a Whisper word take its timing; unaligned lyrics
+    words take the timing of the next Whisper word, or are extrapolated past
+    the end of the transcription.
     """
+    import numpy as np
+
+    lyrics = [(lw, normalize_word(lw)) for lw in lyrics_words]
+    lyrics = [(lw, norm) for lw, norm in lyrics if norm]
+    n_l, n_w = len(lyrics), len(whisper_words)
+    if n_l == 0 or n_w == 0:
+        return []
+
+    L = np.array([norm for _, norm in lyrics])[:, None]
+    W = np.array([ww["norm"] for ww in whisper_words])[None, :]
+    partial = ((np.char.find(L, W) >= 0) | (np.char.find(W, L) >= 0)) & (W != "")
+    score = np.where(
+        L == W, MATCH_SCORE,
+        np.where(partial, PARTIAL_SCORE, MISMATCH_SCORE),
+    ).astype(np.int32)
+
+    # H[i, j]: best score aligning the first i lyrics words with the first j
+    # Whisper words; leading Whisper words are free to skip (H[0, :] = 0).
+    H = np.zeros((n_l + 1, n_w + 1), dtype=np.int32)
+    ramp = np.arange(n_w + 1, dtype=np.int32) * GAP_SCORE
+    for i in range(1, n_l + 1):
+        T = np.empty(n_w + 1, dtype=np.int32)
+        T[0] = i * GAP_SCORE
+        np.maximum(H[i - 1, :-1] + score[i - 1], H[i - 1, 1:] + GAP_SCORE, out=T[1:])
+        # H[i, j] = max(T[j], H[i, j-1] + GAP) == ramp[j] + cummax(T - ramp)[j]
+        H[i] = np.maximum.accumulate(T - ramp) + ramp
+
+    # Traceback from the best end column (trailing Whisper words are free)
+    i, j = n_l, int(np.argmax(H[n_l]))
+    aligned = [None] * n_l   # (whisper index, matched?) per lyrics word
+    while i > 0:
+        if j > 0 and H[i, j] == H[i - 1, j - 1] + score[i - 1, j - 1]:
+            aligned[i - 1] = (j - 1, True)
+            i, j = i - 1, j - 1
+        elif H[i, j] == H[i - 1, j] + GAP_SCORE:
+            aligned[i - 1] = (j, False)   # j = next Whisper word
+            i -= 1
+        else:
+            j -= 1
+
     result = []
-    w_idx = 0  # whisper word pointer
-
-    for lw in lyrics_words:
-        norm_lw = normalize_word(lw)
-        if not norm_lw:
-            continue
-
-        # Search ahead in whisper words for a match
-        best_match_idx = -1
-        search_window = min(w_idx + 8, len(whisper_words))
-
-        for i in range(w_idx, search_window):
-            if whisper_words[i]["norm"] == norm_lw:
-                best_match_idx = i
-                break
-            # Partial match
-            if norm_lw in whisper_words[i]["norm"] or whisper_words[i]["norm"] in norm_lw:
-                if best_match_idx < 0:
-                    best_match_idx = i
-
-        if best_match_idx >= 0:
-            ww = whisper_words[best_match_idx]
-            result.append({
-                "word": lw,
-                "start": ww["start"],
-                "end": ww["end"],
-            })
-            w_idx = best_match_idx + 1
-        elif w_idx < len(whisper_words):
-            # No match found: use current whisper word position anyway
+    for (lw, _), (w_idx, matched) in zip(lyrics, aligned):
+        if matched or w_idx < n_w:
             ww = whisper_words[w_idx]
             result.append({
                 "word": lw,
                 "start": ww["start"],
                 "end": ww["end"],
             })
-            # Don't advance w_idx (multiple lyrics words may map to one whisper word)
         elif result:
             # Past end of whisper words: extrapolate
             last = result[-1]
@@ -163,9 +221,97 @@ def _fallback_align(lyrics_words: list, segments: list) -> list:
     return result
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print(f"Usage: {sys.argv[0]} <audio_wav> <lyrics_txt> <output_json>", file=sys.stderr)
+def _socket_path(socket_path: str = None) -> str:
+    return (socket_path or os.environ.get(SOCKET_ENV)
+            or worker_socket.default_socket_path("align_lyrics"))
+
+
+def serve(socket_path: str = None) -> None:
+    """
+    Load the model once and align requests sent by --client until killed.
+    Each request is an (audio_path, lyrics_path, output_path) tuple; the reply
+    is ("ok", output_path) or ("error", message).
+    """
+    socket_path = _socket_path(socket_path)
+    model = load_model()
+
+    listener = worker_socket.listen(socket_path)
+    print(f"[align_lyrics] Serving on {socket_path}")
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, EOFError) as e:
+                print(f"[align_lyrics] Rejected connection: {e}", file=sys.stderr)
+                continue
+            with conn:
+                try:
+                    audio_path, lyrics_path, output_path = conn.recv()
+                    align_lyrics(audio_path, lyrics_path, output_path, model=model)
+                    conn.send(("ok", output_path))
+                except (Exception, SystemExit) as e:
+                    print(f"[align_lyrics] Request failed: {e}", file=sys.stderr)
+                    try:
+                        conn.send(("error", str(e)))
+                    except OSError:
+                        pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def client(socket_path: str, audio_path: str, lyrics_path: str, output_path: str) -> None:
+    """Send one request to a running server, or align in-process if none is up."""
+    socket_path = _socket_path(socket_path)
+    # The server may run in another working directory
+    request = tuple(os.path.abspath(p) for p in (audio_path, lyrics_path, output_path))
+    try:
+        conn = worker_socket.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"[align_lyrics] No server on {socket_path}, aligning in-process")
+        align_lyrics(audio_path, lyrics_path, output_path)
+        return
+    except AuthenticationError:
+        print(f"WARNING: server on {socket_path} rejected our key, aligning in-process",
+              file=sys.stderr)
+        align_lyrics(audio_path, lyrics_path, output_path)
+        return
+
+    with conn:
+        conn.send(request)
+        status, detail = conn.recv()
+    if status != "ok":
+        print(f"ERROR: {detail}", file=sys.stderr)
         sys.exit(1)
+    print(f"[align_lyrics] Saved to: {output_path}")
+
 
-    align_lyrics(sys.argv[1], sys.argv[2], sys.argv[3])
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Align lyrics words to audio with faster-whisper.")
+    parser.add_argument("paths", nargs="*", metavar="PATH",
+                        help="<audio_wav> <lyrics_txt> <output_json>")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--serve", action="store_true",
+                      help="Keep the model loaded and serve requests on --socket")
+    mode.add_argument("--client", action="store_true",
+                      help="Send the request to a running --serve process")
+    parser.add_argument("--socket", default=None,
+                        help=f"Unix socket path (default: ${SOCKET_ENV}, else "
+                             f"align_lyrics.sock in $XDG_RUNTIME_DIR or a private temp dir)")
+    args = parser.parse_args()
+
+    if args.serve:
+        if args.paths:
+            parser.error("--serve takes no positional arguments")
+        serve(args.socket)
+    elif len(args.paths) != 3:
+        parser.error("expected <audio_wav> <lyrics_txt> <output_json>")
+    elif args.client:
+        client(args.socket, *args.paths)
+    else:
+        align_lyrics(*args.paths)
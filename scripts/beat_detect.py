@@ -8,30 +8,45 @@ import sys
 import json
 import os
 
+# Analysis sample rate: plenty for beat tracking and about half the FFT work
+# of the 44.1/48 kHz source audio.
+BEAT_SAMPLE_RATE = 22050
+
 
 def detect_beats(audio_path: str, output_path: str) -> None:
     try:
         import librosa
         import numpy as np
+        import soundfile as sf
     except ImportError:
         print("ERROR: librosa not installed. Run: pip3 install librosa soundfile", file=sys.stderr)
         sys.exit(1)
 
     print(f"[beat_detect] Loading audio: {audio_path}")
-    y, sr = librosa.load(audio_path, sr=None, mono=True)
+    try:
+        # Read float32 samples directly; libsndfile handles WAV/FLAC/OGG
+        # without librosa.load's generic decoding path.
+        data, sr = sf.read(audio_path, dtype="float32", always_2d=True)
+        y = data.mean(axis=1) if data.shape[1] > 1 else np.ascontiguousarray(data[:, 0])
+    except RuntimeError:
+        # Format libsndfile can't read (e.g. mp3 on old versions)
+        y, sr = librosa.load(audio_path, sr=BEAT_SAMPLE_RATE, mono=True,
+                             dtype=np.float32)
+    if sr != BEAT_SAMPLE_RATE:
+        y = librosa.resample(y, orig_sr=sr, target_sr=BEAT_SAMPLE_RATE)
+        sr = BEAT_SAMPLE_RATE
     print(f"[beat_detect] Audio loaded: {len(y)/sr:.2f}s @ {sr}Hz")
 
+    # Onset strength envelope, computed once and shared with the beat tracker
+    # (beat_track would otherwise run its own STFT over the whole file).
+    # aggregate=np.median matches what beat_track uses internally.
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr, aggregate=np.median)
+
     # Detect tempo and beats
     print("[beat_detect] Detecting beats...")
-    tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
-
-    # Convert frame indices to time
-    beat_times = librosa.frames_to_time(beats, sr=sr).tolist()
-
-    # Also get onset strength for more accurate beat positions
-    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
+    tempo, beats = librosa.beat.beat_track(onset_envelope=onset_env, sr=sr)
 
-    # Refine beat positions using onset strength
+    # Convert frame indices to time, clamped to the onset envelope range
     beat_times_refined = librosa.frames_to_time(
         librosa.util.fix_frames(beats, x_min=0, x_max=len(onset_env) - 1),
         sr=sr
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Convert a Hugging Face Whisper checkpoint to a pre-quantized CTranslate2
+model directory for transcribe_lyrics.py.
+Usage: python3 convert_whisper_model.py [--model NAME] [--quantization TYPE] [--output DIR]
+
+Defaults: openai/whisper-base, int8_bfloat16, models/whisper-base-int8_bfloat16.
+The weights are stored already quantized, so loading skips the float16 to
+int8 conversion and reads half the bytes from disk. Use the result with:
+
+  WHISPER_MODEL=models/whisper-base-int8_bfloat16 \\
+  WHISPER_COMPUTE_TYPE=int8_bfloat16 python3 transcribe_lyrics.py ...
+
+(int8_bfloat16 needs a GPU with bfloat16 support, i.e. Ampere or newer, or a
+CPU with AVX512-BF16/AMX; use --quantization int8 elsewhere.)
+
+Requires: pip3 install ctranslate2 transformers torch
+"""
+
+import sys
+import os
+
+# Files faster-whisper reads next to model.bin
+COPY_FILES = ["tokenizer.json", "preprocessor_config.json"]
+
+
+def convert(model_name: str, quantization: str, output_dir: str) -> None:
+    try:
+        from ctranslate2.converters import TransformersConverter
+    except ImportError:
+        print("ERROR: ctranslate2 not installed. Run: pip3 install ctranslate2 transformers torch",
+              file=sys.stderr)
+        sys.exit(1)
+
+    print(f"[convert_whisper_model] Converting {model_name} ({quantization}) -> {output_dir}")
+    try:
+        converter = TransformersConverter(model_name, copy_files=COPY_FILES)
+        converter.convert(output_dir, quantization=quantization, force=True)
+    except Exception as e:
+        print(f"ERROR: Conversion failed: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"[convert_whisper_model] Saved to: {os.path.abspath(output_dir)}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert a Whisper model to a quantized CTranslate2 directory.")
+    parser.add_argument("--model", default="openai/whisper-base",
+                        help="Hugging Face model name or path (default: openai/whisper-base)")
+    parser.add_argument("--quantization", default="int8_bfloat16",
+                        help="weight type: int8, int8_float16, int8_bfloat16, ... (default: int8_bfloat16)")
+    parser.add_argument("--output", default=None,
+                        help="output directory (default: models/<model>-<quantization>)")
+    args = parser.parse_args()
+
+    output_dir = args.output or os.path.join(
+        "models", f"{os.path.basename(args.model.rstrip('/'))}-{args.quantization}")
+    convert(args.model, args.quantization, output_dir)
@@ -2,6 +2,10 @@
 """
 Person cutout using rembg (background removal).
 Usage: python3 cutout.py <input_video_path> <output_mask_path> [mode]
+                         [--device auto|cpu|cuda] [--int8] [--workers N]
+                         [--batch-size N]
+       python3 cutout.py --serve [--device ...] [--int8] [--workers N]
+                         [--batch-size N]
 
 mode:
   removeBg      (default) White = person, black = background.
@@ -9,6 +13,33 @@ mode:
   removePerson  Inverted:  White = background, black = person.
                            Apply as mask to remove person, keep background.
 
+--device:
+  auto          (default) Use the first available accelerator: CUDA
+                (onnxruntime-gpu), CoreML (macOS) or DirectML
+                (onnxruntime-directml, Windows), otherwise CPU.
+  cpu / cuda    Force a device. CUDA requires `pip3 install onnxruntime-gpu`.
+
+--int8:
+  On CPU, run a dynamically INT8-quantized copy of u2net_human_seg
+  (created next to the FP32 model in ~/.u2net on first use; needs the
+  `onnx` package). Set $CUTOUT_INT8_MODEL to the path of a model quantized
+  ahead of time to skip that step. Ignored when running on CUDA.
+
+--workers:
+  Number of segmentation worker processes (default 1 = run in-process).
+  Each worker holds its own ONNX Runtime session and segments whole
+  batches; the CPU threads are split evenly between workers.
+
+--batch-size:
+  Frames per ONNX Runtime call (default: $CUTOUT_BATCH_SIZE, else 8).
+  Larger batches help most on CUDA.
+
+--serve:
+  Load the model once, then read newline-delimited JSON jobs from stdin,
+  e.g. {"input": "proxy.mp4", "output": "mask.mp4", "mode": "removeBg"}.
+  After each job one JSON status line is printed:
+  {"status": "ok", "output": ...} or {"status": "error", "error": ...}.
+
 Generates a grayscale mask video using rembg with u2net_human_seg model.
 
 Improvements over naive per-frame segmentation:
@@ -23,347 +54,816 @@ Improvements over naive per-frame segmentation:
 
 import sys
 import os
+import json
+import queue
 import subprocess
 import tempfile
-import shutil
+import threading
+from bisect import bisect_right
+from collections import deque
+
+from media_probe import probe_video
+
+# Mask modes: removeBg keeps the person (white), removePerson inverts the mask.
+MODES = ("removeBg", "removePerson")
+
+# Frames per ONNX Runtime call (overridden by $CUTOUT_BATCH_SIZE / --batch-size).
+BATCH_SIZE = 8
+
+# Decoded frames buffered between the ffmpeg reader thread and inference,
+# and finished masks buffered between inference and the ffmpeg writer
+# thread, in batches.
+FRAME_QUEUE_BATCHES = 2
+
+# Batches in flight per segmentation worker process (--workers > 1).
+WORKER_PREFETCH = 2
+
+# Longest side of the frames fed to segmentation (never upscaled).
+MAX_FRAME_DIM = 540
+
+# Grayscale MAD (0-255) between consecutive frames above which a cut is declared.
+SCENE_CUT_THRESHOLD = 25.0
+
+# Temporal blend weights (prev, current, next) keyed by which neighbours are
+# in the same scene.  A skipped neighbour's weight is redistributed so the
+# weights always sum to 1.0.
+_W_PREV, _W_CURR, _W_NEXT = 0.15, 0.70, 0.15
+BLEND_WEIGHTS = {
+    (True, True):   (_W_PREV, _W_CURR, _W_NEXT),
+    (True, False):  (_W_PREV / (_W_PREV + _W_CURR), _W_CURR / (_W_PREV + _W_CURR), 0.0),
+    (False, True):  (0.0, _W_CURR / (_W_CURR + _W_NEXT), _W_NEXT / (_W_CURR + _W_NEXT)),
+    (False, False): (0.0, 1.0, 0.0),
+}
+
+# Accelerated ONNX Runtime execution providers tried by --device auto, in order.
+GPU_PROVIDERS = (
+    "CUDAExecutionProvider",
+    "CoreMLExecutionProvider",
+    "DmlExecutionProvider",
+)
+
+# u2net_human_seg preprocessing constants (same as rembg's session).
+U2NET_SIZE = (320, 320)
+U2NET_MEAN = (0.485, 0.456, 0.406)
+U2NET_STD  = (0.229, 0.224, 0.225)
 
 
-def _run_ffmpeg(args: list, label: str) -> None:
-    """Run ffmpeg with the given args, printing stderr to stdout on failure."""
+def _target_size(width: int, height: int):
+    """
+    Cap the longer dimension at MAX_FRAME_DIM and NEVER upscale.  The proxy is
+    already created with height=540, so landscape proxies (960x540) are
+    downscaled to 540x304 while portrait proxies (304x540) stay at 304x540
+    instead of being upscaled to 540x960 (which would make rembg ~3x slower
+    for no reason).
+
+    Both dimensions are rounded down to even values, which yuv420p encoding
+    of the mask video strictly requires.
+    """
+    scale = min(1.0, MAX_FRAME_DIM / max(width, height))
+    w = max(2, int(round(width * scale)) // 2 * 2)
+    h = max(2, int(round(height * scale)) // 2 * 2)
+    return w, h
+
+
+def _start_frame_reader(input_path: str, width: int, height: int,
+                        frame_queue: "queue.Queue"):
+    """
+    Decode input_path with ffmpeg straight to raw RGB24 frames of
+    width x height (no intermediate files) and feed them into frame_queue
+    from a background thread, followed by a None sentinel.  Decoding thus
+    overlaps with segmentation.
+
+    Each queue item is (frame, is_cut): frame is a (height, width, 3) uint8
+    numpy array and is_cut tells whether it starts a new scene.  Scene-cut
+    detection runs on this thread too, off the inference thread.
+
+    Returns (proc, stderr_file, thread); once the sentinel has been
+    received, check thread.error (the exception that stopped the thread
+    early, else None), then call _finish_ffmpeg().
+    """
+    import cv2
+    import numpy as np
+
+    stderr_file = tempfile.TemporaryFile()
     try:
-        subprocess.run(args, check=True, capture_output=True)
-    except subprocess.CalledProcessError as e:
-        stderr_text = e.stderr.decode(errors='replace').strip()
-        print(f"ERROR: {label} failed (exit {e.returncode}):", flush=True)
-        if stderr_text:
-            for line in stderr_text.splitlines():
-                print(f"  ffmpeg: {line}", flush=True)
+        proc = subprocess.Popen(
+            [
+                # -nostdin: under --serve, stdin carries the job stream and
+                # ffmpeg would otherwise read it for interactive commands
+                "ffmpeg", "-nostdin", "-v", "error",
+                "-i", input_path,
+                "-vf", f"scale={width}:{height}",
+                "-f", "rawvideo",
+                "-pix_fmt", "rgb24",
+                "-",
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=stderr_file,
+        )
+    except FileNotFoundError:
+        print(f"ERROR: ffmpeg not found. Please install ffmpeg.", flush=True)
         sys.exit(1)
+
+    frame_size = width * height * 3
+
+    def _read_frames():
+        # Grayscale frames and their difference reuse three buffers
+        gray = np.empty((height, width), np.uint8)
+        prev_gray = np.empty_like(gray)
+        diff = np.empty_like(gray)
+        first = True
+        try:
+            while True:
+                buf = proc.stdout.read(frame_size)
+                if len(buf) < frame_size:
+                    break
+                frame = np.frombuffer(buf, dtype=np.uint8).reshape(height, width, 3)
+                cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY, dst=gray)
+                is_cut = not first and _is_scene_cut(prev_gray, gray, diff=diff)
+                gray, prev_gray = prev_gray, gray
+                first = False
+                frame_queue.put((frame, is_cut))
+        except Exception as e:
+            # Reported by the consumer; without it the mask would just end early
+            thread.error = e
+        finally:
+            # Always unblock the consumer, even when decoding failed
+            frame_queue.put(None)
+
+    thread = threading.Thread(target=_read_frames, daemon=True)
+    thread.error = None
+    thread.start()
+    return proc, stderr_file, thread
+
+
+def _start_mask_writer(output_path: str, width: int, height: int, fps: float,
+                       mask_queue: "queue.Queue"):
+    """
+    Start ffmpeg encoding raw 8-bit grayscale frames of width x height into
+    an H.264 mask video at output_path.  A background thread writes the
+    frames put on mask_queue (bytes, followed by a None sentinel) to its
+    stdin, so encoding overlaps with segmentation.
+
+    Returns (proc, stderr_file, thread); join the thread after the sentinel,
+    then call _finish_ffmpeg().
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    stderr_file = tempfile.TemporaryFile()
+    try:
+        proc = subprocess.Popen(
+            [
+                "ffmpeg", "-y", "-v", "error",
+                "-f", "rawvideo",
+                "-pix_fmt", "gray",
+                "-s", f"{width}x{height}",
+                "-framerate", str(fps),
+                "-i", "-",
+                "-c:v", "libx264",
+                "-preset", "veryfast",
+                "-pix_fmt", "yuv420p",
+                output_path,
+            ],
+            stdin=subprocess.PIPE,
+            stderr=stderr_file,
+        )
     except FileNotFoundError:
         print(f"ERROR: ffmpeg not found. Please install ffmpeg.", flush=True)
         sys.exit(1)
 
+    def _write_masks():
+        failed = False
+        while True:
+            data = mask_queue.get()
+            if data is None:
+                break
+            if failed:
+                continue   # keep draining; _finish_ffmpeg reports the error
+            try:
+                proc.stdin.write(data)
+            except (BrokenPipeError, ValueError):
+                failed = True
+
+    thread = threading.Thread(target=_write_masks, daemon=True)
+    thread.start()
+    return proc, stderr_file, thread
+
+
+def _finish_ffmpeg(proc, stderr_file, label: str) -> None:
+    """
+    Close our end of an ffmpeg pipe, wait for the process and report its
+    stderr on failure.
+    """
+    for pipe in (proc.stdin, proc.stdout):
+        if pipe is not None:
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                pass
+    proc.wait()
+    if proc.returncode != 0:
+        stderr_file.seek(0)
+        stderr_text = stderr_file.read().decode(errors='replace').strip()
+        print(f"ERROR: {label} failed (exit {proc.returncode}):", flush=True)
+        if stderr_text:
+            for line in stderr_text.splitlines():
+                print(f"  ffmpeg: {line}", flush=True)
+        sys.exit(1)
+    stderr_file.close()
+
+
+def _abort_pipeline(reader, writer, frame_queue: "queue.Queue",
+                    mask_queue: "queue.Queue") -> None:
+    """
+    Kill the reader and writer ffmpeg processes ((proc, stderr_file, thread)
+    tuples) after an error, let their helper threads run to completion, then
+    reap the processes and close their pipes and stderr files, so nothing is
+    left behind when the process keeps running (--serve).
+    """
+    for proc, _, _ in (reader, writer):
+        if proc.poll() is None:
+            proc.kill()
+    # The writer thread drains the queue until it sees the sentinel
+    if writer[2].is_alive():
+        mask_queue.put(None)
+    # The reader thread hits EOF on the killed pipe; unblock its last puts
+    while reader[2].is_alive():
+        try:
+            frame_queue.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    writer[2].join()
+    for proc, stderr_file, _ in (reader, writer):
+        for pipe in (proc.stdin, proc.stdout):
+            if pipe is not None:
+                try:
+                    pipe.close()
+                except OSError:
+                    pass
+        proc.wait()
+        stderr_file.close()
+
+
+def _session_providers(device: str) -> list:
+    """Return the ONNX Runtime execution providers to use for `device`."""
+    import onnxruntime as ort
+
+    if device == 'cpu':
+        return ["CPUExecutionProvider"]
+    available = ort.get_available_providers()
+    candidates = ("CUDAExecutionProvider",) if device == 'cuda' else GPU_PROVIDERS
+    for provider in candidates:
+        if provider in available:
+            return [provider, "CPUExecutionProvider"]
+    if device == 'cuda':
+        print("[cutout] WARNING: CUDA requested but CUDAExecutionProvider is not "
+              "available (pip3 install onnxruntime-gpu); using CPU.", flush=True)
+    return ["CPUExecutionProvider"]
+
+
+def _int8_model_path(fp32_path: str) -> str:
+    """
+    Return the path of a dynamically INT8-quantized copy of the ONNX model at
+    fp32_path, quantizing it on first use (one-off, a few seconds).
+    $CUTOUT_INT8_MODEL, if set, names a pre-quantized model to use instead.
+    """
+    prequantized = os.environ.get("CUTOUT_INT8_MODEL")
+    if prequantized:
+        if not os.path.isfile(prequantized):
+            raise FileNotFoundError(f"CUTOUT_INT8_MODEL not found: {prequantized}")
+        return prequantized
+
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    root, ext = os.path.splitext(fp32_path)
+    int8_path = f"{root}_int8{ext}"
+    if not os.path.exists(int8_path):
+        print(f"[cutout] Quantizing model to INT8: {int8_path}", flush=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=ext, dir=os.path.dirname(int8_path))
+        os.close(fd)
+        try:
+            quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, int8_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return int8_path
+
 
-def _erode_mask(binary, iterations: int = 2):
+def _load_segmentation_session(device: str, int8: bool = False,
+                               threads: int = 0):
     """
-    Simple binary erosion using numpy (no scipy dependency).
-    Shrinks True regions; border pixels are always set to False.
+    Create the ONNX Runtime InferenceSession for u2net_human_seg.
+
+    The FP32 model is downloaded (if needed) through rembg; with int8=True on
+    CPU the quantized copy is loaded instead.  threads > 0 caps ONNX
+    Runtime's intra-op thread pool (used to split cores between workers).
     """
+    from rembg.sessions.u2net_human_seg import U2netHumanSegSession
+    import onnxruntime as ort
+
+    providers = _session_providers(device)
+    print(f"[cutout] Execution providers: {', '.join(providers)}", flush=True)
+
+    sess_opts = ort.SessionOptions()
+    # Full graph fusion (conv+activation, etc.) for both FP32 and INT8 graphs.
+    sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads > 0:
+        sess_opts.intra_op_num_threads = threads
+
+    model_path = U2netHumanSegSession.download_models()
+    if int8 and providers == ["CPUExecutionProvider"]:
+        try:
+            model_path = _int8_model_path(model_path)
+            print("[cutout] Using INT8 model", flush=True)
+        except Exception as e:
+            print(f"[cutout] WARNING: INT8 model unavailable ({e}); using FP32.",
+                  flush=True)
+
+    return ort.InferenceSession(model_path, sess_options=sess_opts,
+                                providers=providers)
+
+
+# Per-process session of a segmentation worker (see _init_worker).
+_WORKER_SESSION = None
+_WORKER_ERROR = None
+
+
+def _init_worker(device: str, int8: bool, threads: int) -> None:
+    """Pool initializer: load one segmentation session per worker process."""
+    global _WORKER_SESSION, _WORKER_ERROR
+    try:
+        _WORKER_SESSION = _load_segmentation_session(device, int8, threads)
+    except Exception as e:
+        # Raised from _segment_in_worker; an initializer that raises would
+        # make the pool respawn the worker forever.
+        _WORKER_ERROR = e
+
+
+def _segment_in_worker(frames: list) -> list:
+    """Run _segment_batch with this worker's session."""
+    if _WORKER_SESSION is None:
+        raise RuntimeError(f"Failed to load segmentation model: {_WORKER_ERROR}")
+    return _segment_batch(_WORKER_SESSION, frames)
+
+
+def _segment_batch(sess, frames: list) -> list:
+    """
+    Run u2net_human_seg on a list of (H, W, 3) uint8 RGB frames with one
+    ONNX Runtime call.
+
+    Bypasses rembg.remove() and feeds the InferenceSession a
+    (N, 3, 320, 320) batch, using the same normalisation and min-max
+    post-processing as rembg's U2netHumanSegSession.  Resizing is done with
+    OpenCV directly on the numpy frames (no PIL images).
+
+    Returns one uint8 mask (0-255) per frame, resized back to the frame size.
+    """
+    import cv2
     import numpy as np
-    result = binary.astype(bool)
-    for _ in range(iterations):
-        up    = np.roll(result, -1, axis=0)
-        down  = np.roll(result,  1, axis=0)
-        left  = np.roll(result, -1, axis=1)
-        right = np.roll(result,  1, axis=1)
-        result = result & up & down & left & right
-        # Border pixels always removed by erosion
-        result[ 0, :] = False
-        result[-1, :] = False
-        result[ :, 0] = False
-        result[ :,-1] = False
-    return result
-
-
-def _tighten_mask(mask_array):
+
+    input_name = sess.get_inputs()[0].name
+    mean = np.array(U2NET_MEAN, dtype=np.float32)
+    std = np.array(U2NET_STD, dtype=np.float32)
+
+    # Each frame is resized into one reused uint8 buffer and normalised
+    # channel by channel straight into the NCHW float32 batch:
+    # (x / max - mean) / std == x * (1 / (max * std)) - mean / std
+    batch = np.empty((len(frames), 3, U2NET_SIZE[1], U2NET_SIZE[0]),
+                     dtype=np.float32)
+    im = np.empty((U2NET_SIZE[1], U2NET_SIZE[0], 3), dtype=np.uint8)
+    offset = mean / std
+    for k, frame in enumerate(frames):
+        cv2.resize(frame, U2NET_SIZE, dst=im, interpolation=cv2.INTER_AREA)
+        scale = np.float32(1.0) / (max(float(im.max()), 1e-6) * std)
+        for c in range(3):
+            np.multiply(im[:, :, c], scale[c], out=batch[k, c])
+            batch[k, c] -= offset[c]
+
+    try:
+        pred = sess.run(None, {input_name: batch})[0][:, 0, :, :]
+    except Exception:
+        if len(frames) == 1:
+            raise
+        # Model exported with a fixed batch dimension: run frames one by one.
+        pred = np.concatenate([
+            sess.run(None, {input_name: batch[k:k + 1]})[0][:, 0, :, :]
+            for k in range(len(frames))
+        ])
+
+    masks = []
+    for k, frame in enumerate(frames):
+        p = pred[k]
+        mi, ma = float(p.min()), float(p.max())
+        p = ((p - mi) / max(ma - mi, 1e-6) * 255).astype(np.uint8)
+        h, w = frame.shape[:2]
+        masks.append(cv2.resize(p, (w, h), interpolation=cv2.INTER_LANCZOS4))
+    return masks
+
+
+def _tighten_mask(mask_array, out=None, scratch=None):
     """
     Tighten the raw rembg alpha mask to remove the semi-transparent halo:
       1. Hard threshold at 180 – keeps only high-confidence person pixels.
       2. Erode 2 px inward to strip any residual fringe at the boundary.
-      3. Gaussian blur (r=1.5 px) to restore natural-looking soft edges.
+      3. Gaussian blur (sigma=1.5 px) to restore natural-looking soft edges.
+
+    All three steps run in OpenCV on the uint8 array (no PIL round-trip).
+    Pass preallocated uint8 `out` / `scratch` arrays of the mask's shape to
+    reuse them across frames instead of allocating per call.
 
-    Returns a uint8 numpy array (0-255).
+    Returns a uint8 numpy array (0-255), `out` if given.
     """
-    from PIL import Image, ImageFilter
+    import cv2
     import numpy as np
 
-    binary = mask_array > 180          # only confident person pixels
-    eroded = _erode_mask(binary, iterations=2)
-    smooth = (
-        Image.fromarray(eroded.astype(np.uint8) * 255)
-        .filter(ImageFilter.GaussianBlur(radius=1.5))
-    )
-    return np.array(smooth)
+    if scratch is None:
+        scratch = np.empty_like(mask_array)
+    if out is None:
+        out = np.empty_like(mask_array)
 
+    # Confident person pixels → 255, rest → 0
+    cv2.threshold(mask_array, 180, 255, cv2.THRESH_BINARY, dst=scratch)
+    cross = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+    cv2.erode(scratch, cross, dst=scratch, iterations=2,
+              borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    cv2.GaussianBlur(scratch, (0, 0), sigmaX=1.5, dst=out)
+    return out
 
-def _detect_scene_changes(frames_dir: str, frames: list,
-                           threshold: float = 25.0) -> set:
-    """
-    Detect hard scene cuts by computing the grayscale mean-absolute-difference
-    (MAD) between consecutive frames.
 
-    Returns a set of frame *indices* that start a new scene.
-    Index 0 is always included as the first scene boundary.
+def _is_scene_cut(prev_gray, gray, threshold: float = SCENE_CUT_THRESHOLD,
+                  diff=None) -> bool:
+    """
+    Detect a hard scene cut by computing the grayscale mean-absolute-difference
+    (MAD) between two consecutive uint8 frames, using OpenCV's native
+    absdiff/mean.  diff is an optional preallocated scratch array.
 
     threshold: MAD value (0-255) above which a cut is declared.
                25 works well for typical compressed video; lower = more
                sensitive, higher = fewer cuts detected.
     """
-    from PIL import Image
-    import numpy as np
+    import cv2
 
-    boundaries = {0}
-    print(f"[cutout] Detecting scene cuts (threshold={threshold})...",
-          flush=True)
-
-    for i in range(1, len(frames)):
-        prev = np.array(
-            Image.open(os.path.join(frames_dir, frames[i - 1])).convert("L"),
-            dtype=float,
-        )
-        curr = np.array(
-            Image.open(os.path.join(frames_dir, frames[i])).convert("L"),
-            dtype=float,
-        )
-        if np.mean(np.abs(prev - curr)) > threshold:
-            boundaries.add(i)
-
-    n_scenes = len(boundaries)
-    print(f"[cutout] Found {n_scenes} scene(s) / {n_scenes - 1} cut(s).",
-          flush=True)
-    return boundaries
+    diff = cv2.absdiff(prev_gray, gray, dst=diff)
+    return cv2.mean(diff)[0] > threshold
 
 
 def _scene_range(idx: int, sorted_boundaries: list, n: int):
     """Return (scene_start, scene_end) for frame index idx."""
-    start = 0
-    for b in sorted_boundaries:
-        if b <= idx:
-            start = b
-    end = n
-    for b in sorted_boundaries:
-        if b > idx:
-            end = b
-            break
+    k = bisect_right(sorted_boundaries, idx)
+    start = sorted_boundaries[k - 1] if k > 0 else 0
+    end = sorted_boundaries[k] if k < len(sorted_boundaries) else n
     return start, end
 
 
-def _apply_temporal_smoothing(raw_masks_dir: str, masks_dir: str,
-                               frames: list, scene_boundaries: set) -> None:
+def _smooth_mask(idx: int, window: tuple, sorted_boundaries: list,
+                 n: int, out=None, scratch=None):
     """
-    Blend each tight raw mask with its immediate neighbours using weights
+    Blend tight mask idx with its immediate neighbours using weights
     [prev=0.15, current=0.70, next=0.15].
 
+    window: (prev, curr, next) tight masks for frames idx-1, idx, idx+1;
+            prev/next are None when the frame does not exist.
+    n:      number of frames known so far (idx+2 while streaming, the total
+            frame count for the last frame).
+
     Blending is skipped across scene boundaries: if a neighbour belongs to a
-    different scene, its weight is redistributed to the current frame so the
-    total always sums to 1.0.
+    different scene, BLEND_WEIGHTS gives its weight to the current frame.
 
-    Writes smoothed masks directly to masks_dir (uint8 PNG).
+    out (uint8) and scratch (two float32 arrays) may be preallocated with the
+    mask's shape to avoid per-frame allocations.  Returns the smoothed mask.
     """
-    from PIL import Image
     import numpy as np
 
-    n = len(frames)
-    sorted_boundaries = sorted(scene_boundaries)
-    weights = {-1: 0.15, 0: 0.70, 1: 0.15}
-
-    for i, frame_file in enumerate(frames):
-        mask_name = frame_file.replace(".jpg", ".png")
-        s_start, s_end = _scene_range(i, sorted_boundaries, n)
-
-        blended_sum = None
-        total_w = 0.0
-
-        for offset, w in weights.items():
-            j = i + offset
-            # Skip frames outside the current scene or video
-            if j < s_start or j >= s_end or j < 0 or j >= n:
-                continue
-            neighbor_mask = frames[j].replace(".jpg", ".png")
-            arr = np.array(
-                Image.open(os.path.join(raw_masks_dir, neighbor_mask)),
-                dtype=float,
-            )
-            blended_sum = arr * w if blended_sum is None else blended_sum + arr * w
-            total_w += w
-
-        if blended_sum is None or total_w == 0:
-            # Fallback: copy raw mask unchanged
-            shutil.copy(
-                os.path.join(raw_masks_dir, mask_name),
-                os.path.join(masks_dir, mask_name),
-            )
-            continue
-
-        # Renormalize in case some neighbours were skipped (scene boundaries)
-        final = np.clip(blended_sum / total_w, 0, 255).astype(np.uint8)
-        Image.fromarray(final).save(os.path.join(masks_dir, mask_name))
-
+    prev, curr, nxt = window
+    s_start, s_end = _scene_range(idx, sorted_boundaries, n)
+    has_prev = prev is not None and idx - 1 >= s_start
+    has_next = nxt is not None and idx + 1 < s_end
+    w_prev, w_curr, w_next = BLEND_WEIGHTS[(has_prev, has_next)]
+
+    if out is None:
+        out = np.empty_like(curr)
+    if scratch is None:
+        scratch = (np.empty(curr.shape, np.float32), np.empty(curr.shape, np.float32))
+    acc, tmp = scratch
+
+    np.multiply(curr, np.float32(w_curr), out=acc)
+    if has_prev:
+        np.multiply(prev, np.float32(w_prev), out=tmp)
+        acc += tmp
+    if has_next:
+        np.multiply(nxt, np.float32(w_next), out=tmp)
+        acc += tmp
+
+    np.clip(acc, 0, 255, out=acc)
+    np.copyto(out, acc, casting='unsafe')
+    return out
+
+
+def _read_batches(frame_queue: "queue.Queue", batch_size: int = BATCH_SIZE):
+    """Yield lists of up to batch_size (frame, is_cut) items from frame_queue."""
+    eof = False
+    while not eof:
+        batch = []
+        while len(batch) < batch_size:
+            item = frame_queue.get()
+            if item is None:
+                eof = True
+                break
+            batch.append(item)
+        if batch:
+            yield batch
+
+
+def _segment_batches(batches, session=None, pool=None, workers: int = 1):
+    """
+    Yield (batch, raw_masks) for every batch, in input order.
 
-def process_cutout(input_path: str, output_path: str,
-                   mode: str = 'removeBg') -> None:
+    Batches are segmented with `session` in this process, or on `pool`
+    with at most WORKER_PREFETCH batches in flight per worker, so decoded
+    frames never pile up in the pool's task queue.
+    """
+    if pool is None:
+        for batch in batches:
+            yield batch, _segment_batch(session, [frame for frame, _ in batch])
+        return
+
+    pending = deque()
+    for batch in batches:
+        pending.append((batch, pool.apply_async(
+            _segment_in_worker, ([frame for frame, _ in batch],))))
+        if len(pending) >= workers * WORKER_PREFETCH:
+            done, result = pending.popleft()
+            yield done, result.get()
+    while pending:
+        done, result = pending.popleft()
+        yield done, result.get()
+
+
+def _check_dependencies() -> None:
     try:
-        from rembg import remove, new_session
-        from PIL import Image, ImageOps
-        import numpy as np
+        import rembg  # noqa: F401
+        import numpy as np  # noqa: F401
+        import cv2  # noqa: F401  (used by _tighten_mask)
     except ImportError:
         print(
             "ERROR: rembg not installed.\n"
-            "Run: pip3 install rembg onnxruntime pillow numpy",
+            "Run: pip3 install rembg onnxruntime numpy opencv-python-headless",
             file=sys.stderr,
         )
         sys.exit(1)
 
+
+def load_segmenter(device: str = 'auto', int8: bool = False, workers: int = 1):
+    """
+    Load the human segmentation model: return (session, None) for in-process
+    inference, or (None, pool) with one session per worker process when
+    workers > 1.  Pass the result to process_cutout() to reuse it.
+    """
+    if workers > 1:
+        import multiprocessing
+
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        print(f"[cutout] Starting {workers} segmentation workers "
+              f"({threads} thread(s) each)...", flush=True)
+        pool = multiprocessing.Pool(processes=workers, initializer=_init_worker,
+                                    initargs=(device, int8, threads))
+        return None, pool
+
+    print("[cutout] Loading segmentation model...", flush=True)
+    try:
+        session = _load_segmentation_session(device, int8)
+    except Exception as e:
+        print(f"ERROR: Failed to load segmentation model: {e}", flush=True)
+        sys.exit(1)
+    print("[cutout] Model loaded", flush=True)
+    return session, None
+
+
+def process_cutout(input_path: str, output_path: str,
+                   mode: str = 'removeBg', device: str = 'auto',
+                   int8: bool = False, workers: int = 1,
+                   batch_size: int = BATCH_SIZE, segmenter=None) -> None:
+    """
+    Write the mask video for input_path to output_path.  segmenter is an
+    optional (session, pool) pair from load_segmenter(); without it the model
+    is loaded for this call only.
+    """
+    _check_dependencies()
+    import numpy as np
+
     invert_mask = (mode == 'removePerson')
     print(f"[cutout] Input: {input_path}", flush=True)
     print(f"[cutout] Output: {output_path}", flush=True)
     print(f"[cutout] Mode: {mode} (invert={invert_mask})", flush=True)
 
+    if mode not in MODES:
+        print(f"ERROR: Unknown mode {mode!r} (expected one of: {', '.join(MODES)})",
+              flush=True)
+        sys.exit(1)
+
     if not os.path.exists(input_path):
         print(f"ERROR: Input file not found: {input_path}", flush=True)
         sys.exit(1)
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        frames_dir   = os.path.join(tmpdir, "frames")
-        raw_masks_dir = os.path.join(tmpdir, "raw_masks")  # tight, per-frame
-        masks_dir    = os.path.join(tmpdir, "masks")       # temporally smoothed
-        os.makedirs(frames_dir)
-        os.makedirs(raw_masks_dir)
-        os.makedirs(masks_dir)
-
-        # Extract frames from proxy video.
-        # Use scale=540:540:force_original_aspect_ratio=decrease to cap the longer
-        # dimension at 540px and NEVER upscale.  The proxy is already created with
-        # height=540, so landscape proxies (960x540) are downscaled to 540x304 while
-        # portrait proxies (304x540) stay at 304x540 instead of being upscaled to
-        # 540x960 (which would make rembg ~3x slower for no reason).
-        #
-        # force_divisible_by=2 ensures output dimensions are always even, which is
-        # required for yuv420p encoding in the assembly step.
-        print("[cutout] Extracting frames...", flush=True)
-        _run_ffmpeg(
-            [
-                "ffmpeg", "-y",
-                "-i", input_path,
-                "-vf", "scale=540:540:force_original_aspect_ratio=decrease:force_divisible_by=2",
-                "-q:v", "3",
-                os.path.join(frames_dir, "frame_%06d.jpg"),
-            ],
-            "Frame extraction",
-        )
-
-        frames = sorted(f for f in os.listdir(frames_dir) if f.endswith(".jpg"))
-        total = len(frames)
-        if total == 0:
-            print("ERROR: No frames extracted from input video.", flush=True)
-            sys.exit(1)
-        print(f"[cutout] Processing {total} frames...", flush=True)
-
-        # Load human segmentation model
-        print("[cutout] Loading segmentation model...", flush=True)
-        try:
-            session = new_session("u2net_human_seg")
-        except Exception as e:
-            print(f"ERROR: Failed to load segmentation model: {e}", flush=True)
-            sys.exit(1)
-        print("[cutout] Model loaded, starting frame processing...", flush=True)
-
-        # --- Pass 1: segment + tighten each frame independently ---
-        # Raw masks: tight mask per frame (tightened, optionally inverted).
-        # Stored in raw_masks_dir; temporal smoothing happens in pass 2.
-        for i, frame_file in enumerate(frames):
-            frame_path = os.path.join(frames_dir, frame_file)
-            mask_path  = os.path.join(raw_masks_dir,
-                                      frame_file.replace(".jpg", ".png"))
+    src_w, src_h, fps, est_total = probe_video(input_path)
+    if src_w <= 0 or src_h <= 0:
+        print("ERROR: Could not determine input video dimensions.", flush=True)
+        sys.exit(1)
+    width, height = _target_size(src_w, src_h)
+
+    # Load human segmentation model (once per worker process with --workers).
+    # This must happen before the reader/writer threads start: the worker
+    # pool forks, and a child forked while OpenCV threads hold locks can
+    # deadlock.
+    owns_segmenter = segmenter is None
+    if owns_segmenter:
+        segmenter = load_segmenter(device, int8, workers)
+    session, pool = segmenter
+
+    # Decode frames from the proxy video in a background thread while
+    # inference runs; frames never touch the disk.
+    print(f"[cutout] Decoding frames at {width}x{height} "
+          f"(batches of {batch_size})...", flush=True)
+    frame_queue = queue.Queue(maxsize=FRAME_QUEUE_BATCHES * batch_size)
+    mask_queue = queue.Queue(maxsize=FRAME_QUEUE_BATCHES * batch_size)
+    try:
+        reader = _start_frame_reader(input_path, width, height, frame_queue)
+        # Final masks are piped straight into the encoder as they are produced
+        writer = _start_mask_writer(output_path, width, height, fps, mask_queue)
+    except BaseException:
+        if pool is not None and owns_segmenter:
+            pool.terminate()
+        raise
+    reader_proc, reader_err, reader_thread = reader
+    writer_proc, writer_err, writer_thread = writer
+    print(f"[cutout] Processing ~{est_total} frames...", flush=True)
 
+    try:
+        # --- Segment + tighten each frame, then smooth it temporally ---
+        # Tight masks live in a ring buffer of three preallocated arrays
+        # (frames i-2, i-1, i); as soon as mask i is ready, frame i-1 has both
+        # neighbours and its smoothed mask is handed to the writer thread.  Scene
+        # cuts are flagged by the reader thread as frames are decoded, so decode,
+        # inference and encode all run concurrently.
+        ring = None
+        tight_scratch = None
+        smooth_buf = None
+        smooth_scratch = None
+        scene_boundaries = [0]   # sorted: cuts are found in frame order
+        total = 0
+
+        def write_smoothed(idx: int, n: int) -> None:
+            window = (
+                ring[(idx - 1) % 3] if idx > 0 else None,
+                ring[idx % 3],
+                ring[(idx + 1) % 3] if idx + 1 < n else None,
+            )
+            final = _smooth_mask(idx, window, scene_boundaries, n,
+                                 out=smooth_buf, scratch=smooth_scratch)
+            if writer_proc.poll() is not None:
+                # Encoder died early: report it instead of segmenting on
+                _finish_ffmpeg(writer_proc, writer_err, "Mask video encoding")
+            mask_queue.put(final.tobytes())
+
+        segmented = _segment_batches(_read_batches(frame_queue, batch_size), session, pool, workers)
+        while True:
+            b_start = total
             try:
-                img = Image.open(frame_path).convert("RGBA")
-                output_img = remove(img, session=session, only_mask=True)
+                batch, raw_masks = next(segmented)
+            except StopIteration:
+                break
             except Exception as e:
-                print(f"ERROR: Frame {i+1}/{total} processing failed: {e}",
+                print(f"ERROR: Frames from {b_start+1} processing failed: {e}",
                       flush=True)
                 sys.exit(1)
+            b_end = b_start + len(batch)
+
+            for i, (_, is_cut), raw_alpha in zip(range(b_start, b_end), batch, raw_masks):
+                # Scene cuts (used to limit temporal blending)
+                if is_cut:
+                    scene_boundaries.append(i)
+
+                # Tighten mask: threshold → erode → Gaussian blur
+                if ring is None:
+                    ring = [np.empty_like(raw_alpha) for _ in range(3)]
+                    tight_scratch = np.empty_like(raw_alpha)
+                    smooth_buf = np.empty_like(raw_alpha)
+                    smooth_scratch = (np.empty(raw_alpha.shape, np.float32),
+                                      np.empty(raw_alpha.shape, np.float32))
+                tight = _tighten_mask(raw_alpha, out=ring[i % 3],
+                                      scratch=tight_scratch)
+
+                # Invert for removePerson mode (background=white)
+                if invert_mask:
+                    np.subtract(255, tight, out=tight)
+
+                # Frame i-1 now has both neighbours available
+                if i > 0:
+                    write_smoothed(i - 1, i + 1)
+                total = i + 1
+
+                pct = min(100, int(total / max(est_total, total) * 100))
+                print(f"[cutout] {pct}% ({total}/{max(est_total, total)})", flush=True)
+
+        if pool is not None and owns_segmenter:
+            pool.close()
+            pool.join()
+
+        if reader_thread.error is not None:
+            print(f"ERROR: Frame decoding failed after {total} frames: "
+                  f"{reader_thread.error}", flush=True)
+            sys.exit(1)
+        _finish_ffmpeg(reader_proc, reader_err, "Frame extraction")
 
-            # Extract alpha channel (raw confidence / mask)
-            if output_img.mode == "L":
-                raw_alpha = np.array(output_img)
-            else:
-                raw_alpha = np.array(output_img.split()[-1])
-
-            # Tighten mask: threshold → erode → Gaussian blur
-            tight = _tighten_mask(raw_alpha)
-
-            # Invert for removePerson mode (background=white)
-            if invert_mask:
-                tight = 255 - tight
+        if total == 0:
+            print("ERROR: No frames extracted from input video.", flush=True)
+            sys.exit(1)
 
-            Image.fromarray(tight).save(mask_path)
+        # Last frame has no successor
+        write_smoothed(total - 1, total)
 
-            pct = int((i + 1) / total * 100)
-            print(f"[cutout] {pct}% ({i+1}/{total})", flush=True)
+        n_scenes = len(scene_boundaries)
+        print(f"[cutout] Found {n_scenes} scene(s) / {n_scenes - 1} cut(s).",
+              flush=True)
 
-        # --- Scene change detection (used to limit temporal blending) ---
-        scene_boundaries = _detect_scene_changes(frames_dir, frames)
+        # --- Finish the mask video ---
+        print("[cutout] Finalizing mask video...", flush=True)
+        mask_queue.put(None)
+        writer_thread.join()
+        _finish_ffmpeg(writer_proc, writer_err, "Mask video encoding")
+    except BaseException:
+        _abort_pipeline(reader, writer, frame_queue, mask_queue)
+        if pool is not None and owns_segmenter:
+            pool.terminate()
+        raise
 
-        # --- Pass 2: temporal smoothing across neighbouring frames ---
-        if total > 1:
-            print("[cutout] Applying temporal smoothing...", flush=True)
-            _apply_temporal_smoothing(
-                raw_masks_dir, masks_dir, frames, scene_boundaries
-            )
-        else:
-            # Single frame: just copy without smoothing
-            mask_name = frames[0].replace(".jpg", ".png")
-            shutil.copy(
-                os.path.join(raw_masks_dir, mask_name),
-                os.path.join(masks_dir, mask_name),
-            )
+    print(f"[cutout] Done: {output_path}", flush=True)
 
-        # --- Assemble mask frames into output video ---
-        print("[cutout] Assembling mask video...", flush=True)
 
-        # Get FPS from input
-        result = subprocess.run(
-            [
-                "ffprobe", "-v", "error",
-                "-select_streams", "v:0",
-                "-show_entries", "stream=r_frame_rate",
-                "-of", "default=noprint_wrappers=1:nokey=1",
-                input_path,
-            ],
-            capture_output=True,
-            text=True,
-        )
-        fps_str = result.stdout.strip()
+def serve(device: str = 'auto', int8: bool = False, workers: int = 1,
+          batch_size: int = BATCH_SIZE) -> None:
+    """
+    Load the model once and process newline-delimited JSON jobs from stdin
+    ({"input", "output", optional "mode"}) until EOF.
+    """
+    _check_dependencies()
+    segmenter = load_segmenter(device, int8, workers)
+    print("[cutout] Serving jobs from stdin", flush=True)
+    for line in sys.stdin:
+        if not line.strip():
+            continue
         try:
-            num, den = fps_str.split("/")
-            fps = float(num) / float(den)
-        except Exception:
-            fps = 30.0
-
-        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
-
-        # scale=trunc(iw/2)*2:trunc(ih/2)*2 ensures the PNG frames (which may have
-        # odd dimensions despite force_divisible_by=2 in extraction, e.g. if Pillow
-        # saves at a slightly different size) are rounded down to even before encoding
-        # with yuv420p, which strictly requires even width and height.
-        _run_ffmpeg(
-            [
-                "ffmpeg", "-y",
-                "-framerate", str(fps),
-                "-i", os.path.join(masks_dir, "frame_%06d.png"),
-                "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
-                "-c:v", "libx264",
-                "-preset", "veryfast",
-                "-pix_fmt", "yuv420p",
-                output_path,
-            ],
-            "Mask video assembly",
-        )
+            job = json.loads(line)
+            process_cutout(job["input"], job["output"],
+                           job.get("mode", "removeBg"), device, int8,
+                           workers, batch_size, segmenter)
+            status = {"status": "ok", "output": job["output"]}
+        except SystemExit as e:
+            # Details were already printed as ERROR lines
+            status = {"status": "error", "error": f"job failed (exit code {e.code})"}
+        except Exception as e:
+            status = {"status": "error", "error": str(e)}
+        print(json.dumps(status), flush=True)
 
-    print(f"[cutout] Done: {output_path}", flush=True)
+    _, pool = segmenter
+    if pool is not None:
+        pool.close()
+        pool.join()
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3 or len(sys.argv) > 4:
-        print(f"Usage: {sys.argv[0]} <input_video> <output_mask_mp4> [removeBg|removePerson]",
-              file=sys.stderr)
-        sys.exit(1)
-
-    mode_arg = sys.argv[3] if len(sys.argv) == 4 else 'removeBg'
-    if mode_arg not in ('removeBg', 'removePerson'):
-        print(f"ERROR: Unknown mode '{mode_arg}'. Use 'removeBg' or 'removePerson'.",
-              file=sys.stderr)
-        sys.exit(1)
-
-    process_cutout(sys.argv[1], sys.argv[2], mode_arg)
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Generate a grayscale person mask video with rembg.")
+    parser.add_argument("input_video", nargs="?")
+    parser.add_argument("output_mask_mp4", nargs="?")
+    parser.add_argument("mode", nargs="?", default="removeBg",
+                        choices=MODES)
+    parser.add_argument("--serve", action="store_true",
+                        help="keep the model loaded and read JSON jobs from stdin")
+    parser.add_argument("--device", default="auto",
+                        choices=("auto", "cpu", "cuda"),
+                        help="ONNX Runtime device for segmentation (default: auto)")
+    parser.add_argument("--int8", action="store_true",
+                        help="use an INT8-quantized model for CPU inference")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="segmentation worker processes (default: 1, in-process)")
+    parser.add_argument("--batch-size", type=int,
+                        default=int(os.environ.get("CUTOUT_BATCH_SIZE", BATCH_SIZE)),
+                        help=f"frames per inference call (default: $CUTOUT_BATCH_SIZE or {BATCH_SIZE})")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+
+    if args.serve:
+        serve(args.device, args.int8, args.workers, args.batch_size)
+        sys.exit(0)
+    if not args.output_mask_mp4:
+        parser.error("input_video and output_mask_mp4 are required")
+
+    process_cutout(args.input_video, args.output_mask_mp4, args.mode,
+                   args.device, args.int8, args.workers, args.batch_size)
@@ -2,11 +2,16 @@
 """
 Head stabilization using face detection.
 
-Detects head position per frame using OpenCV's Haar cascade face detector
-and applies smoothed crop transforms to stabilize the video.
+Detects head position per frame using OpenCV's YuNet DNN face detector
+(falling back to the bundled Haar cascade when the YuNet model cannot be
+loaded) and applies smoothed crop transforms to stabilize the video.
+
+The YuNet model is downloaded on first use to ~/.opencv/ and checked against
+its sha256 (override the path with the YUNET_MODEL environment variable).
 
 Usage:
   python3 head_stabilize.py <input_video> <output_video> <smooth_x> <smooth_y> <smooth_z>
+  python3 head_stabilize.py --serve
 
 Arguments:
   input_video   Path to the proxy video (540p)
@@ -14,22 +19,64 @@ Arguments:
   smooth_x      0-1  Stabilization strength on X axis  (0=off, 1=fully stabilized)
   smooth_y      0-1  Stabilization strength on Y axis
   smooth_z      0-1  Stabilization strength on Z (zoom: keep consistent face size)
+
+--serve keeps the face detector loaded and reads newline-delimited JSON jobs
+from stdin, e.g. {"input": ..., "output": ..., "smooth_x": 1, "smooth_y": 1,
+"smooth_z": 0}, printing one {"status": "ok"|"error", ...} line per job.
 """
 
 import sys
 import os
+import json
 import subprocess
 import tempfile
 import math
 
-
-def detect_face(gray, face_cascade):
+YUNET_MODEL_URL = (
+    "https://github.com/opencv/opencv_zoo/raw/main/models/"
+    "face_detection_yunet/face_detection_yunet_2023mar.onnx"
+)
+# sha256 of the 2023mar release; a download with other content is rejected,
+# so a changed upstream file can never be loaded in its place
+YUNET_MODEL_SHA256 = "8f2383e4dd3cfbb4553ea8718107fc0423210dc964f9f4280604804ed2552fa4"
+YUNET_MODEL_PATH = os.path.join(
+    os.path.expanduser("~"), ".opencv", "face_detection_yunet_2023mar.onnx")
+
+# Why the YuNet download failed, if it did; later jobs in the same process go
+# straight to the Haar cascade instead of waiting on the network again
+_YUNET_DOWNLOAD_ERROR = None
+
+# Minimum YuNet confidence for a detection to count as a face.
+YUNET_SCORE_THRESHOLD = 0.6
+
+# Longest side of the downscaled copy of each frame that YuNet runs on (never
+# upscaled).  Plenty to locate a face once positions are EMA-smoothed.
+DETECT_MAX_DIM = 240
+
+# The Haar cascade cannot find faces smaller than its 24x24 window, so its
+# frames are only shrunk until the smallest face it should find
+# (HAAR_MIN_FACE full-frame pixels) fills that window.
+HAAR_WINDOW = 24
+HAAR_MIN_FACE = 30
+
+# Run face detection on every Nth frame only (and right after a scene cut);
+# the EMA-smoothed face position carries over the frames in between.
+DETECT_EVERY = 3
+
+# Scene cuts are detected on a tiny grayscale thumbnail: mean absolute
+# difference (0-255) between consecutive thumbnails above which a cut is
+# declared.
+SCENE_THUMB_SIZE = (64, 36)
+SCENE_CUT_THRESHOLD = 25.0
+
+
+def detect_face(gray, face_cascade, min_size: int = 30):
     """Return (cx, cy, size) of the largest detected face, or None."""
     faces = face_cascade.detectMultiScale(
         gray,
         scaleFactor=1.1,
         minNeighbors=4,
-        minSize=(30, 30),
+        minSize=(min_size, min_size),
     )
     if len(faces) == 0:
         return None
@@ -38,8 +85,179 @@ def detect_face(gray, face_cascade):
     return (fx + fw / 2.0, fy + fh / 2.0, max(fw, fh))
 
 
+def detect_face_yunet(frame, detector):
+    """Return (cx, cy, size) of the largest face YuNet finds in a BGR frame, or None."""
+    _, faces = detector.detect(frame)
+    if faces is None or len(faces) == 0:
+        return None
+    # Rows are (x, y, w, h, 5 landmark points, score); use largest face by area
+    fx, fy, fw, fh = max(faces, key=lambda f: f[2] * f[3])[:4]
+    return (fx + fw / 2.0, fy + fh / 2.0, max(fw, fh))
+
+
+def _yunet_model_path() -> str:
+    """
+    Return the YuNet ONNX model path, downloading it on first use.  Raises
+    RuntimeError when the download fails (or failed earlier in this process)
+    or the downloaded file does not match YUNET_MODEL_SHA256.
+    """
+    global _YUNET_DOWNLOAD_ERROR
+
+    path = os.environ.get("YUNET_MODEL", YUNET_MODEL_PATH)
+    if os.path.exists(path):
+        return path
+    if _YUNET_DOWNLOAD_ERROR is not None:
+        raise RuntimeError(_YUNET_DOWNLOAD_ERROR)
+
+    import hashlib
+    import urllib.request
+
+    print(f"[head_stabilize] Downloading YuNet model to {path}")
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".onnx", dir=os.path.dirname(os.path.abspath(path)))
+        with open(fd, "wb") as f, \
+                urllib.request.urlopen(YUNET_MODEL_URL, timeout=30) as resp:
+            data = resp.read()
+            f.write(data)
+        digest = hashlib.sha256(data).hexdigest()
+        if digest != YUNET_MODEL_SHA256:
+            raise ValueError(f"checksum mismatch for {YUNET_MODEL_URL} "
+                             f"(sha256 {digest}, expected {YUNET_MODEL_SHA256})")
+        os.replace(tmp_path, path)
+    except Exception as e:
+        _YUNET_DOWNLOAD_ERROR = f"YuNet model download failed: {e}"
+        raise RuntimeError(_YUNET_DOWNLOAD_ERROR) from e
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def load_face_detector(frame_w: int, frame_h: int):
+    """
+    Return a detect(frame) function mapping a BGR frame of frame_w x frame_h
+    to (cx, cy, size) of the largest face, or None.
+
+    Uses YuNet (one DNN forward pass per frame, on CUDA when OpenCV was built
+    with it) and falls back to the Haar cascade when the model is unavailable.
+    YuNet runs on a copy downscaled to DETECT_MAX_DIM, the cascade on one
+    downscaled by HAAR_WINDOW / HAAR_MIN_FACE; the returned coordinates are
+    in full-frame pixels.
+    """
+    import cv2
+    import numpy as np
+
+    def scaler(scale):
+        # (downscale, to_frame, small_w, small_h) for a detection scale
+        small_w = max(1, int(round(frame_w * scale)))
+        small_h = max(1, int(round(frame_h * scale)))
+        small = np.empty((small_h, small_w, 3), dtype=np.uint8)
+
+        def downscale(frame):
+            if scale == 1.0:
+                return frame
+            return cv2.resize(frame, (small_w, small_h), dst=small,
+                              interpolation=cv2.INTER_AREA)
+
+        def to_frame(detection):
+            if detection is None:
+                return None
+            cx, cy, size = detection
+            return (cx / scale, cy / scale, size / scale)
+
+        return downscale, to_frame, small_w, small_h
+
+    try:
+        downscale, to_frame, small_w, small_h = scaler(
+            min(1.0, DETECT_MAX_DIM / max(frame_w, frame_h)))
+        if cv2.cuda.getCudaEnabledDeviceCount() > 0:
+            backend, target = cv2.dnn.DNN_BACKEND_CUDA, cv2.dnn.DNN_TARGET_CUDA
+        else:
+            backend, target = cv2.dnn.DNN_BACKEND_OPENCV, cv2.dnn.DNN_TARGET_CPU
+        detector = cv2.FaceDetectorYN.create(
+            _yunet_model_path(), "", (small_w, small_h),
+            score_threshold=YUNET_SCORE_THRESHOLD,
+            backend_id=backend, target_id=target,
+        )
+        print("[head_stabilize] Face detector: YuNet")
+        return lambda frame: to_frame(detect_face_yunet(downscale(frame), detector))
+    except Exception as e:
+        print(f"[head_stabilize] WARNING: YuNet unavailable ({e}); using Haar cascade.")
+
+    # Load Haar cascade (bundled with OpenCV)
+    cascade_path = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+    face_cascade = cv2.CascadeClassifier(cascade_path)
+    print("[head_stabilize] Face detector: Haar cascade")
+
+    # A HAAR_MIN_FACE face in the frame is HAAR_WINDOW pixels after scaling
+    downscale, to_frame, small_w, small_h = scaler(min(1.0, HAAR_WINDOW / HAAR_MIN_FACE))
+    min_size = HAAR_WINDOW
+
+    gray = np.empty((small_h, small_w), dtype=np.uint8)
+
+    def detect(frame):
+        cv2.cvtColor(downscale(frame), cv2.COLOR_BGR2GRAY, dst=gray)
+        return to_frame(detect_face(gray, face_cascade, min_size))
+
+    return detect
+
+
+def open_video(input_path: str):
+    """
+    Open input_path for decoding and return (frames, width, height, fps,
+    frame_count, close), where frames yields BGR24 uint8 arrays, or None if
+    the file cannot be opened.
+
+    Uses PyAV when installed (libavcodec directly, with frame-threaded
+    decoding) and falls back to cv2.VideoCapture otherwise.
+    """
+    try:
+        import av
+    except ImportError:
+        av = None
+
+    if av is not None:
+        try:
+            container = av.open(input_path)
+            stream = container.streams.video[0]
+        except (av.error.FFmpegError, IndexError):
+            return None
+        stream.thread_type = "AUTO"
+        fps = float(stream.average_rate or stream.guessed_rate or 30.0)
+        frames = (f.to_ndarray(format="bgr24") for f in container.decode(stream))
+        return (frames, stream.codec_context.width, stream.codec_context.height,
+                fps, stream.frames, container.close)
+
+    import cv2
+
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        return None
+
+    def read_frames():
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                return
+            yield frame
+
+    return (read_frames(),
+            int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            cap.get(cv2.CAP_PROP_FPS) or 30.0,
+            int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+            cap.release)
+
+
 def process_stabilize(input_path: str, output_path: str,
-                      smooth_x: float, smooth_y: float, smooth_z: float) -> None:
+                      smooth_x: float, smooth_y: float, smooth_z: float,
+                      detectors: dict = None) -> None:
+    """
+    Stabilize input_path into output_path.  detectors is an optional cache of
+    face detectors keyed by frame size, reused across calls (--serve).
+    """
     try:
         import cv2
         import numpy as np
@@ -55,65 +273,102 @@ def process_stabilize(input_path: str, output_path: str,
     print(f"[head_stabilize] Output: {output_path}")
     print(f"[head_stabilize] Smoothing X={smooth_x:.2f}  Y={smooth_y:.2f}  Z={smooth_z:.2f}")
 
-    # Load Haar cascade (bundled with OpenCV)
-    cascade_path = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-    face_cascade = cv2.CascadeClassifier(cascade_path)
-
-    cap = cv2.VideoCapture(input_path)
-    if not cap.isOpened():
+    video = open_video(input_path)
+    if video is None:
         print(f"ERROR: cannot open {input_path}", file=sys.stderr)
         sys.exit(1)
-
-    frame_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    frame_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames, frame_w, frame_h, fps, total_frames, close_video = video
 
     print(f"[head_stabilize] Video: {frame_w}x{frame_h} @ {fps:.2f} fps  ({total_frames} frames)")
 
-    # Initial crop: centered, full frame
-    cx = frame_w / 2.0        # crop center X
-    cy = frame_h / 2.0        # crop center Y
-    crop_w = float(frame_w)   # crop window width
-    crop_h = float(frame_h)   # crop window height
-
-    canvas_cx = frame_w / 2.0
-    canvas_cy = frame_h / 2.0
-    aspect = frame_h / frame_w
-
-    # Internal EMA alpha for frame-to-frame noise reduction
-    # 0.2 → ~5-frame time constant at 30fps (≈ 0.17 s), smooth but responsive
-    INTERNAL_ALPHA = 0.2
-
-    # Target face fraction of frame width when zoom stabilization is active.
-    # If face_w / frame_w ≈ TARGET_FACE_FRACTION, crop_w ≈ frame_w (no zoom).
-    TARGET_FACE_FRACTION = 0.25
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-        frames_dir = os.path.join(tmpdir, "frames")
-        out_dir = os.path.join(tmpdir, "out")
-        os.makedirs(frames_dir)
-        os.makedirs(out_dir)
+    # Under --serve the process outlives a failed job: always release the
+    # decoder, the encoder process and its stderr file
+    stderr_file = tempfile.TemporaryFile()
+    ffmpeg_proc = None
+    try:
+        if detectors is None:
+            detectors = {}
+        detect = detectors.get((frame_w, frame_h))
+        if detect is None:
+            detect = detectors[(frame_w, frame_h)] = load_face_detector(frame_w, frame_h)
+
+        # Initial crop: centered, full frame
+        cx = frame_w / 2.0        # crop center X
+        cy = frame_h / 2.0        # crop center Y
+        crop_w = float(frame_w)   # crop window width
+        crop_h = float(frame_h)   # crop window height
+
+        canvas_cx = frame_w / 2.0
+        canvas_cy = frame_h / 2.0
+        aspect = frame_h / frame_w
+
+        # Internal EMA alpha for frame-to-frame noise reduction
+        # 0.2 → ~5-frame time constant at 30fps (≈ 0.17 s), smooth but responsive
+        INTERNAL_ALPHA = 0.2
+
+        # Target face fraction of frame width when zoom stabilization is active.
+        # If face_w / frame_w ≈ TARGET_FACE_FRACTION, crop_w ≈ frame_w (no zoom).
+        TARGET_FACE_FRACTION = 0.25
+
+        # Stabilized frames are piped as raw BGR24 straight into the encoder
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        try:
+            ffmpeg_proc = subprocess.Popen(
+                [
+                    "ffmpeg", "-y", "-v", "error",
+                    "-f", "rawvideo",
+                    "-pix_fmt", "bgr24",
+                    "-s", f"{frame_w}x{frame_h}",
+                    "-framerate", str(fps),
+                    "-i", "-",
+                    "-c:v", "libx264",
+                    "-preset", "veryfast",
+                    "-crf", "23",
+                    "-pix_fmt", "yuv420p",
+                    output_path,
+                ],
+                stdin=subprocess.PIPE,
+                stderr=stderr_file,
+            )
+        except FileNotFoundError:
+            print("ERROR: ffmpeg not found. Please install ffmpeg.", file=sys.stderr)
+            sys.exit(1)
+
+        # Every stabilized frame is resized into this one buffer
+        out_buf = np.empty((frame_h, frame_w, 3), dtype=np.uint8)
+
+        # Scene-cut check buffers (thumbnail, its grayscale and the previous one)
+        thumb = np.empty((SCENE_THUMB_SIZE[1], SCENE_THUMB_SIZE[0], 3), dtype=np.uint8)
+        gray = np.empty(thumb.shape[:2], dtype=np.uint8)
+        prev_gray = np.empty_like(gray)
+        diff = np.empty_like(gray)
 
         frame_idx = 0
+        last_detect_idx = -1
         prev_face_cx = canvas_cx
         prev_face_cy = canvas_cy
         prev_face_size = frame_w * TARGET_FACE_FRACTION  # default face size guess
 
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
+        for frame in frames:
+            cv2.resize(frame, SCENE_THUMB_SIZE, dst=thumb, interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY, dst=gray)
+            is_cut = (frame_idx > 0 and
+                      cv2.mean(cv2.absdiff(prev_gray, gray, dst=diff))[0] > SCENE_CUT_THRESHOLD)
+            gray, prev_gray = prev_gray, gray
 
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            detection = detect_face(gray, face_cascade)
+            detection = None
+            if frame_idx == 0 or is_cut or frame_idx - last_detect_idx >= DETECT_EVERY:
+                # One EMA step per skipped frame: same time constant as per-frame detection
+                alpha = 1 - (1 - INTERNAL_ALPHA) ** (frame_idx - last_detect_idx)
+                last_detect_idx = frame_idx
+                detection = detect(frame)
 
             if detection is not None:
                 face_cx, face_cy, face_size = detection
                 # EMA smoothing of detected face position
-                prev_face_cx = INTERNAL_ALPHA * face_cx + (1 - INTERNAL_ALPHA) * prev_face_cx
-                prev_face_cy = INTERNAL_ALPHA * face_cy + (1 - INTERNAL_ALPHA) * prev_face_cy
-                prev_face_size = INTERNAL_ALPHA * face_size + (1 - INTERNAL_ALPHA) * prev_face_size
+                prev_face_cx = alpha * face_cx + (1 - alpha) * prev_face_cx
+                prev_face_cy = alpha * face_cy + (1 - alpha) * prev_face_cy
+                prev_face_size = alpha * face_size + (1 - alpha) * prev_face_size
 
             # --- X axis ---
             # Blend between "no tracking" (canvas center) and "full tracking" (face center)
@@ -153,64 +408,103 @@ def process_stabilize(input_path: str, output_path: str,
             x1 = max(0, min(x1, frame_w - crop_w_i))
             y1 = max(0, min(y1, frame_h - crop_h_i))
 
+            # The crop is a view (no copy); resizing it directly is ~4x faster
+            # than an equivalent scale+translate cv2.warpAffine on the full frame
             cropped = frame[y1:y1 + crop_h_i, x1:x1 + crop_w_i]
-            resized = cv2.resize(cropped, (frame_w, frame_h), interpolation=cv2.INTER_LINEAR)
+            resized = cv2.resize(cropped, (frame_w, frame_h), dst=out_buf,
+                                 interpolation=cv2.INTER_LINEAR)
 
-            out_path = os.path.join(out_dir, f"frame_{frame_idx:06d}.jpg")
-            cv2.imwrite(out_path, resized, [cv2.IMWRITE_JPEG_QUALITY, 92])
+            try:
+                ffmpeg_proc.stdin.write(resized.tobytes())
+            except BrokenPipeError:
+                break   # ffmpeg died; reported below
 
             frame_idx += 1
             if frame_idx % 30 == 0 or frame_idx == total_frames:
                 pct = int(frame_idx / max(total_frames, 1) * 100)
                 print(f"[head_stabilize] {pct}% ({frame_idx}/{total_frames})")
 
-        cap.release()
+        print(f"[head_stabilize] Processed {frame_idx} frames. Finalizing output video...")
+
+        try:
+            ffmpeg_proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        ffmpeg_proc.wait()
+        if ffmpeg_proc.returncode != 0:
+            stderr_file.seek(0)
+            print(stderr_file.read().decode(errors="replace"), file=sys.stderr)
+            print(f"ERROR: ffmpeg exited with code {ffmpeg_proc.returncode}", file=sys.stderr)
+            sys.exit(ffmpeg_proc.returncode)
+    except BaseException:
+        if ffmpeg_proc is not None and ffmpeg_proc.poll() is None:
+            ffmpeg_proc.kill()
+        raise
+    finally:
+        close_video()
+        if ffmpeg_proc is not None:
+            try:
+                ffmpeg_proc.stdin.close()
+            except OSError:
+                pass
+            ffmpeg_proc.wait()
+        stderr_file.close()
 
-        print(f"[head_stabilize] Processed {frame_idx} frames. Assembling output video...")
+    print(f"[head_stabilize] Done: {output_path}")
 
-        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
 
-        result = subprocess.run(
-            [
-                "ffmpeg", "-y",
-                "-framerate", str(fps),
-                "-i", os.path.join(out_dir, "frame_%06d.jpg"),
-                "-c:v", "libx264",
-                "-preset", "veryfast",
-                "-crf", "23",
-                "-pix_fmt", "yuv420p",
-                output_path,
-            ],
-            capture_output=True,
-            text=True,
-        )
-        if result.returncode != 0:
-            print(result.stdout, file=sys.stderr)
-            print(result.stderr, file=sys.stderr)
-            print(f"ERROR: ffmpeg exited with code {result.returncode}", file=sys.stderr)
-            sys.exit(result.returncode)
-
-    print(f"[head_stabilize] Done: {output_path}")
+def _clamp01(value) -> float:
+    return max(0.0, min(1.0, float(value)))
+
+
+def serve() -> None:
+    """
+    Process newline-delimited JSON jobs from stdin until EOF, keeping face
+    detectors loaded between jobs.
+    """
+    detectors = {}
+    print("[head_stabilize] Serving jobs from stdin", flush=True)
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+            process_stabilize(
+                job["input"], job["output"],
+                _clamp01(job.get("smooth_x", 0.0)),
+                _clamp01(job.get("smooth_y", 0.0)),
+                _clamp01(job.get("smooth_z", 0.0)),
+                detectors,
+            )
+            status = {"status": "ok", "output": job["output"]}
+        except SystemExit as e:
+            # Details were already printed as ERROR lines
+            status = {"status": "error", "error": f"job failed (exit code {e.code})"}
+        except Exception as e:
+            status = {"status": "error", "error": str(e)}
+        print(json.dumps(status), flush=True)
 
 
 if __name__ == "__main__":
+    if sys.argv[1:] == ["--serve"]:
+        serve()
+        sys.exit(0)
+
     if len(sys.argv) != 6:
         print(
             f"Usage: {sys.argv[0]} <input_video> <output_video> "
-            "<smooth_x> <smooth_y> <smooth_z>",
+            "<smooth_x> <smooth_y> <smooth_z>\n"
+            f"       {sys.argv[0]} --serve",
             file=sys.stderr,
         )
         sys.exit(1)
 
     in_path = sys.argv[1]
     out_path = sys.argv[2]
-    sx = float(sys.argv[3])
-    sy = float(sys.argv[4])
-    sz = float(sys.argv[5])
 
     # Clamp to [0, 1]
-    sx = max(0.0, min(1.0, sx))
-    sy = max(0.0, min(1.0, sy))
-    sz = max(0.0, min(1.0, sz))
+    sx = _clamp01(sys.argv[3])
+    sy = _clamp01(sys.argv[4])
+    sz = _clamp01(sys.argv[5])
 
     process_stabilize(in_path, out_path, sx, sy, sz)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Shared ffprobe helper for the video scripts.
+
+One ffprobe call returns the first video stream's dimensions, frame rate
+and frame count as JSON, so scripts don't spawn a probe per property.
+"""
+
+import json
+import subprocess
+
+
+def parse_rate(rate: str, default: float = 30.0) -> float:
+    """Parse an ffprobe rational frame rate such as '30000/1001'."""
+    try:
+        num, den = rate.split("/")
+        return float(num) / float(den)
+    except Exception:
+        return default
+
+
+def probe_video(path: str):
+    """
+    Return (width, height, fps, frame_count) of the first video stream.
+
+    frame_count comes from the container (nb_frames) or is estimated from
+    the duration; it is only used for progress reporting.
+    """
+    try:
+        result = subprocess.run(
+            [
+                "ffprobe", "-v", "error",
+                "-select_streams", "v:0",
+                "-show_entries", "stream=width,height,r_frame_rate,nb_frames:format=duration",
+                "-of", "json",
+                path,
+            ],
+            capture_output=True,
+            text=True,
+        )
+        info = json.loads(result.stdout or "{}")
+    except (FileNotFoundError, ValueError):
+        info = {}
+
+    stream = (info.get("streams") or [{}])[0]
+    width = int(stream.get("width") or 0)
+    height = int(stream.get("height") or 0)
+    fps = parse_rate(stream.get("r_frame_rate", ""))
+    try:
+        frame_count = int(stream["nb_frames"])
+    except (KeyError, ValueError):
+        try:
+            frame_count = int(float(info["format"]["duration"]) * fps)
+        except (KeyError, ValueError):
+            frame_count = 0
+    return width, height, fps, frame_count
@@ -0,0 +1,57 @@
+"""
+Tests for transcribe_lyrics.py.  Run: python3 -m unittest discover scripts/tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import transcribe_lyrics  # noqa: E402
+
+
+def _cuda_torch():
+    try:
+        import faster_whisper  # noqa: F401
+        import torch
+    except ImportError:
+        return None
+    return torch if torch.cuda.is_available() else None
+
+
+class _Extractor10:
+    """faster-whisper 1.0 style extractor: padding=True means "append 30 s"."""
+    n_fft = 400
+    hop_length = 160
+
+    def __call__(self, waveform, padding=True, chunk_length=None):
+        raise AssertionError("not called")
+
+
+class TorchFeatureExtractorTest(unittest.TestCase):
+
+    def test_rejects_faster_whisper_1_0_contract(self):
+        self.assertIsNone(transcribe_lyrics._TorchFeatureExtractor.create(_Extractor10()))
+
+    @unittest.skipIf(_cuda_torch() is None, "needs faster-whisper and torch with CUDA")
+    def test_matches_numpy_extractor(self):
+        import numpy as np
+        from faster_whisper.feature_extractor import FeatureExtractor
+
+        base = FeatureExtractor()
+        gpu = transcribe_lyrics._TorchFeatureExtractor.create(base)
+        self.assertIsNotNone(gpu)
+
+        rng = np.random.default_rng(0)
+        for seconds in (5, 45):
+            audio = rng.uniform(-0.5, 0.5, seconds * base.sampling_rate).astype(np.float32)
+            for kwargs in ({}, {"chunk_length": 30}, {"padding": 0}):
+                expected = base(audio, **kwargs)
+                actual = gpu(audio, **kwargs)
+                self.assertEqual(actual.shape, expected.shape)
+                np.testing.assert_allclose(actual, expected, atol=1e-3)
+
+
+if __name__ == "__main__":
+    unittest.main()
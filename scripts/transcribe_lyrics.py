@@ -1,91 +1,533 @@
 #!/usr/bin/env python3
 """
 Auto-transcription of lyrics using faster-whisper (no pre-written lyrics required).
-Usage: python3 transcribe_lyrics.py <audio_wav_path> <output_json_path>
+Usage: python3 transcribe_lyrics.py <audio_wav_path> <output_json_path> [language]
+       python3 transcribe_lyrics.py --batch <manifest.txt>
+       python3 transcribe_lyrics.py --serve
+       python3 transcribe_lyrics.py --listen [--socket PATH]
+       python3 transcribe_lyrics.py --client [--socket PATH] <audio_wav_path> <output_json_path> [language]
+
+language is a Whisper language code such as "en" or "cs" (default:
+$LYRICS_LANG). Giving it skips Whisper's language-detection pass; without
+it the language is detected from the first 30 s of audio.
+
+The device is picked automatically (CUDA when available, else CPU); set
+WHISPER_DEVICE (cpu/cuda) and/or WHISPER_COMPUTE_TYPE (e.g. int8, float16,
+int8_float16) to override it. On CUDA, log-mel features are computed on
+the GPU as well when torch (with CUDA) is installed.
+
+The model is "base", or the faster "distil-small.en" when the language is
+English; WHISPER_MODEL selects another size ("tiny" for machines with
+less than 4 GB of RAM, "small", ...) or a local CTranslate2 model directory.
+
+--batch loads the model once and transcribes every line of a manifest,
+each "<audio_wav>\t<output_json>[\t<language>]" (blank lines and lines
+starting with # are skipped); the next file is decoded in the background
+while the current one is transcribed.
+
+Voiced regions are decoded WHISPER_BATCH_SIZE (default 8) 30-second windows
+at a time through faster-whisper's batched pipeline; set it to 1 to decode
+sequentially.
+
+Decoding is greedy (beam size 1, no conditioning on the previous window);
+--beam N or WHISPER_BEAM_SIZE=N switches to beam search for harder audio.
+
+--serve loads the model once and reads newline-delimited JSON jobs
+{"input": ..., "output": ..., "language": ...} from stdin, printing one
+{"status": "ok"|"error", ...} line per job ("language" is optional).
+--listen does the same over a unix socket (default: $TRANSCRIBE_LYRICS_SOCKET,
+else transcribe_lyrics.sock in the per-user directory of worker_socket.py,
+which also handles the connection key); --client sends one job to a
+listening process and transcribes in-process when none is running.
 
 Output JSON format:
 {
-  "text": "full transcribed text as a single string",
   "words": [
     { "word": "hello", "start": 0.10, "end": 0.50 },
     ...
-  ]
+  ],
+  "text": "full transcribed text as a single string"
 }
 """
 
 import sys
 import json
 import os
+from functools import lru_cache
+from multiprocessing import AuthenticationError
+
+import worker_socket
+from whisper_device import cpu_threads, pick_device, pin_thread_pools
+
+# Socket path when --socket is not given; resolved lazily since the default
+# lives in a per-user directory that may need creating
+SOCKET_ENV = "TRANSCRIBE_LYRICS_SOCKET"
 
+# 30-second windows per encoder/decoder call in the batched pipeline
+BATCH_SIZE = int(os.environ.get("WHISPER_BATCH_SIZE", 8))
 
-def transcribe_lyrics(audio_path: str, output_path: str) -> None:
+# Greedy decoding by default; --beam N (or WHISPER_BEAM_SIZE) for beam search
+BEAM_SIZE = int(os.environ.get("WHISPER_BEAM_SIZE", 1))
+
+
+def pick_model(language: str = None) -> str:
+    """
+    Return the Whisper model to load: $WHISPER_MODEL if set, else
+    distil-small.en for English (about 2x faster than base at similar
+    accuracy), else base.
+    """
+    name = os.environ.get("WHISPER_MODEL")
+    if name:
+        return name
+    language = language or os.environ.get("LYRICS_LANG") or ""
+    return "distil-small.en" if language.startswith("en") else "base"
+
+
+def load_model(language: str = None, spare_threads: int = 0):
+    """
+    Load the Whisper model (see pick_model) on the best available device.
+    spare_threads CPU cores are left free for other work (e.g. prefetching).
+    Loaded models are cached per (model, device, compute type, threads), so
+    repeated calls in one process (library use) reuse the same instance.
+    """
+    threads = cpu_threads(spare_threads)
+    # Before faster_whisper is imported, which loads OpenMP and BLAS
+    pin_thread_pools(threads)
+    return _get_model(pick_model(language), *pick_device(), threads)
+
+
+@lru_cache(maxsize=4)
+def _get_model(model_name: str, device: str, compute_type: str, threads: int):
+    """Create a WhisperModel; cached, see load_model."""
     try:
         from faster_whisper import WhisperModel
     except ImportError:
         print("ERROR: faster-whisper not installed. Run: pip3 install faster-whisper", file=sys.stderr)
         sys.exit(1)
 
-    print(f"[transcribe_lyrics] Loading Whisper model (base)...")
-    # Use int8 quantization for faster CPU inference with lower memory usage
-    model = WhisperModel("base", device="cpu", compute_type="int8")
+    print(f"[transcribe_lyrics] Loading Whisper model ({model_name}, {device}/{compute_type})...")
+    # int8 weights: faster inference with lower memory usage on CPU and GPU
+    if device == "cpu":
+        return WhisperModel(model_name, device=device, compute_type=compute_type,
+                            cpu_threads=threads, num_workers=1)
+    try:
+        # FlashAttention-2 fuses QK^T, softmax and PV into one kernel per
+        # attention layer (CTranslate2 >= 4.3, Ampere or newer GPUs)
+        model = WhisperModel(model_name, device=device, compute_type=compute_type,
+                             flash_attention=True)
+    except Exception as e:
+        print(f"[transcribe_lyrics] FlashAttention unavailable ({e}), using standard attention")
+        model = WhisperModel(model_name, device=device, compute_type=compute_type)
+    gpu_features = _TorchFeatureExtractor.create(model.feature_extractor)
+    if gpu_features is not None:
+        print("[transcribe_lyrics] Computing log-mel features on the GPU (torch)")
+        model.feature_extractor = gpu_features
+    return model
+
+
+class _TorchFeatureExtractor:
+    """
+    Stand-in for faster-whisper's FeatureExtractor that computes the log-mel
+    spectrogram with torch on CUDA (cuFFT STFT + cuBLAS mel matmul) instead
+    of NumPy on the CPU.  Other attributes are read from the wrapped
+    extractor; the output matches its NumPy result.
+    """
+
+    def __init__(self, base, torch, device: str = "cuda"):
+        self._base = base
+        self._torch = torch
+        self._device = device
+        self._window = torch.hann_window(base.n_fft, device=device)
+        self._mel_filters = torch.from_numpy(base.mel_filters).to(device)
+
+    @classmethod
+    def create(cls, base):
+        """
+        Wrap base when torch with CUDA is installed and base follows the
+        faster-whisper >= 1.1 contract (padding = extra samples, default
+        160); return None otherwise.  faster-whisper 1.0 passes padding=True
+        to mean "append 30 s", which this implementation does not reproduce.
+        """
+        import inspect
+
+        padding = inspect.signature(type(base).__call__).parameters.get("padding")
+        if padding is None or type(padding.default) is not int:
+            return None
+        try:
+            import torch
+        except ImportError:
+            return None
+        if not torch.cuda.is_available():
+            return None
+        return cls(base, torch)
+
+    def __getattr__(self, name):
+        if name == "_base":
+            raise AttributeError(name)
+        return getattr(self._base, name)
+
+    def __call__(self, waveform, padding=160, chunk_length=None):
+        import numpy as np
+
+        torch = self._torch
+        base = self._base
+        if chunk_length is not None:
+            base.n_samples = chunk_length * base.sampling_rate
+            base.nb_max_frames = base.n_samples // base.hop_length
+
+        audio = torch.from_numpy(np.asarray(waveform, dtype=np.float32)).to(self._device)
+        if padding:
+            audio = torch.nn.functional.pad(audio, (0, padding))
+        stft = torch.stft(audio, base.n_fft, base.hop_length, window=self._window,
+                          center=True, pad_mode="reflect", return_complex=True)
+        magnitudes = stft[..., :-1].abs() ** 2
+        log_spec = torch.clamp(self._mel_filters @ magnitudes, min=1e-10).log10()
+        log_spec = torch.maximum(log_spec, log_spec.max() - 8.0)
+        return ((log_spec + 4.0) / 4.0).cpu().numpy()
+
+
+def _batched_pipeline(model):
+    """
+    Wrap model in faster-whisper's BatchedInferencePipeline, which runs the
+    VAD-split windows of a file through the encoder and decoder together.
+    Returns None when batching is disabled or unavailable (faster-whisper < 1.1).
+    """
+    if BATCH_SIZE <= 1:
+        return None
+    try:
+        from faster_whisper import BatchedInferencePipeline
+    except ImportError:
+        return None
+    return BatchedInferencePipeline(model)
+
+
+def _write_word(f, index: int, word: str, start: float, end: float) -> None:
+    """Append one entry to the streamed "words" array (index 0 = first entry)."""
+    # Formatted directly rather than via a throwaway dict per word; repr()
+    # of a float is exactly what json.dumps would emit for it.
+    f.write(f'{"" if index == 0 else ","}\n    '
+            f'{{"word": {json.dumps(word, ensure_ascii=False)}, "start": {start!r}, "end": {end!r}}}')
+
+
+def _decode_options(beam_size: int) -> dict:
+    """
+    Decoder settings for model.transcribe().  Greedy decoding without
+    conditioning on the previous window is several times cheaper than
+    faster-whisper's default beam search of 5 and is enough for short,
+    repetitive lyric lines; beam_size > 1 restores the quality defaults.
+    (Temperature fallback stays enabled for windows that fail to decode.)
+    """
+    if beam_size <= 1:
+        return {"beam_size": 1, "best_of": 1, "condition_on_previous_text": False}
+    return {"beam_size": beam_size}
 
-    print(f"[transcribe_lyrics] Transcribing: {audio_path}")
-    segments, _info = model.transcribe(
-        audio_path,
-        word_timestamps=True,
-        task="transcribe",
-    )
 
-    # Extract word-level timestamps
-    words = []
-    segment_list = []
+def _collect_words(segments, f) -> tuple:
+    """
+    Consume the segment generator, streaming each word to the open output
+    file f as it is decoded; return (word_texts, segment_count,
+    wordless_segments).  Segments are only kept while no word has been
+    found, since they are needed just for the segment-text fallback.
+    """
+    texts = []
+    wordless = []
+    count = 0
     for segment in segments:
-        segment_list.append(segment)
+        count += 1
+        if not texts:
+            wordless.append(segment)
         for word_data in (segment.words or []):
             w = word_data.word.strip()
             if w:
-                words.append({
-                    "word": w,
-                    "start": float(word_data.start),
-                    "end": float(word_data.end),
-                })
-
-    print(f"[transcribe_lyrics] Found {len(words)} words")
-
-    if not words:
-        # Fall back to segment-level text without timestamps
-        print("[transcribe_lyrics] No word timestamps available, falling back to segment text")
-        for segment in segment_list:
-            seg_words = segment.text.split()
-            seg_start = float(segment.start)
-            seg_end = float(segment.end)
-            if seg_words:
-                dur = (seg_end - seg_start) / len(seg_words)
-                for i, w in enumerate(seg_words):
-                    words.append({
-                        "word": w,
-                        "start": seg_start + i * dur,
-                        "end": seg_start + (i + 1) * dur,
-                    })
-
-    # Build plain text from the detected words (preserving original capitalisation)
-    full_text = " ".join(w["word"] for w in words).strip()
-
-    output = {
-        "text": full_text,
-        "words": words,
-    }
-
-    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(output, f, indent=2)
+                _write_word(f, len(texts), w,
+                            float(word_data.start), float(word_data.end))
+                texts.append(w)
+    return texts, count, (wordless if not texts else [])
+
+
+def transcribe_lyrics(audio_path: str, output_path: str, model=None,
+                      language: str = None, audio=None,
+                      beam_size: int = BEAM_SIZE) -> None:
+    """
+    Transcribe audio_path; pass an already loaded model to skip loading.
+    language (e.g. "en") skips language detection; None falls back to
+    $LYRICS_LANG, then to auto-detection.  audio may hold audio_path already
+    decoded to 16 kHz mono float32 samples (see transcribe_manifest).
+    beam_size 1 decodes greedily (see _decode_options).
+    """
+    import secrets
+
+    language = language or os.environ.get("LYRICS_LANG") or None
+    if model is None:
+        model = load_model(language)
+    elif language and not language.startswith("en") and \
+            not getattr(getattr(model, "model", None), "is_multilingual", True):
+        print(f"[transcribe_lyrics] WARNING: the loaded model is English-only; "
+              f"'{language}' audio will be transcribed as English")
+
+    print(f"[transcribe_lyrics] Transcribing: {audio_path}"
+          + (f" ({language})" if language else ""))
+    decode_options = _decode_options(beam_size)
+    # Silero VAD (built into faster-whisper) drops silences and instrumental
+    # stretches before decoding; timestamps are mapped back to the original
+    # audio, so only voiced regions cost Whisper time.
+    pipeline = _batched_pipeline(model)
+    if pipeline is not None:
+        segments, _info = pipeline.transcribe(
+            audio_path if audio is None else audio,
+            word_timestamps=True,
+            task="transcribe",
+            language=language,
+            vad_filter=True,
+            vad_parameters={"min_silence_duration_ms": 500},
+            batch_size=BATCH_SIZE,
+            **decode_options,
+        )
+    else:
+        segments, _info = model.transcribe(
+            audio_path if audio is None else audio,
+            word_timestamps=True,
+            task="transcribe",
+            language=language,
+            vad_filter=True,
+            vad_parameters={"min_silence_duration_ms": 500},
+            **decode_options,
+        )
+
+    # Words are written while the decoder is still running; the file is
+    # renamed into place once complete, so readers never see partial output.
+    # Exclusive create ("x") rather than mkstemp(), which would make the
+    # output 0600 instead of honouring the umask.
+    output_dir = os.path.dirname(output_path) or "."
+    tmp_path = os.path.join(
+        output_dir, f".{os.path.basename(output_path)}.{secrets.token_hex(4)}.tmp")
+    try:
+        out_file = open(tmp_path, "x", encoding="utf-8")
+    except FileNotFoundError:
+        # Only create the directory when it is missing (rare in batch runs)
+        os.makedirs(output_dir, exist_ok=True)
+        out_file = open(tmp_path, "x", encoding="utf-8")
+    try:
+        with out_file as f:
+            f.write('{\n  "words": [')
+
+            # Extract word-level timestamps
+            texts, segment_count, wordless = _collect_words(segments, f)
+
+            if not segment_count:
+                # VAD can miss heavily accompanied vocals: retry on the full audio
+                print("[transcribe_lyrics] VAD found no voiced audio, transcribing the full file")
+                segments, _info = model.transcribe(
+                    audio_path if audio is None else audio,
+                    word_timestamps=True,
+                    task="transcribe",
+                    language=language,
+                    **decode_options,
+                )
+                texts, segment_count, wordless = _collect_words(segments, f)
+
+            print(f"[transcribe_lyrics] Found {len(texts)} words")
+
+            if not texts:
+                # Fall back to segment-level text without timestamps
+                print("[transcribe_lyrics] No word timestamps available, falling back to segment text")
+                for segment in wordless:
+                    seg_words = segment.text.split()
+                    seg_start = float(segment.start)
+                    seg_end = float(segment.end)
+                    if seg_words:
+                        dur = (seg_end - seg_start) / len(seg_words)
+                        for i, w in enumerate(seg_words):
+                            _write_word(f, len(texts), w, seg_start + i * dur,
+                                        seg_start + (i + 1) * dur)
+                            texts.append(w)
+
+            # Plain text from the detected words (preserving original capitalisation)
+            full_text = " ".join(texts).strip()
+            f.write(f'\n  ],\n  "text": {json.dumps(full_text, ensure_ascii=False)}\n}}\n')
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
     print(f"[transcribe_lyrics] Saved to: {output_path}")
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print(f"Usage: {sys.argv[0]} <audio_wav> <output_json>", file=sys.stderr)
+def transcribe_manifest(manifest_path: str, beam_size: int = BEAM_SIZE) -> int:
+    """
+    Transcribe every job listed in manifest_path with one loaded model.
+    Returns the number of failed jobs.
+    """
+    jobs = []
+    with open(manifest_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            if len(fields) not in (2, 3):
+                print(f"ERROR: bad manifest line (expected audio<TAB>output[<TAB>language]): {line}",
+                      file=sys.stderr)
+                sys.exit(1)
+            jobs.append(fields)
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    # One core is left to a thread that decodes the next file while the
+    # current one is transcribed (CTranslate2 releases the GIL meanwhile).
+    model = load_model(spare_threads=1 if len(jobs) > 1 else 0)
+    from faster_whisper import decode_audio
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = executor.submit(decode_audio, jobs[0][0]) if jobs else None
+        for i, (audio_path, output_path, *language) in enumerate(jobs, 1):
+            print(f"[transcribe_lyrics] Job {i}/{len(jobs)}")
+            decoded = pending
+            pending = executor.submit(decode_audio, jobs[i][0]) if i < len(jobs) else None
+            try:
+                transcribe_lyrics(audio_path, output_path, model=model,
+                                  language=language[0] if language else None,
+                                  audio=decoded.result(), beam_size=beam_size)
+            except Exception as e:
+                print(f"ERROR: {audio_path}: {e}", file=sys.stderr)
+                failed += 1
+    print(f"[transcribe_lyrics] Done: {len(jobs) - failed} ok, {failed} failed")
+    return failed
+
+
+def serve(beam_size: int = BEAM_SIZE) -> None:
+    """
+    Load the model once and process newline-delimited JSON jobs from stdin.
+    The model is picked from $WHISPER_MODEL / $LYRICS_LANG at startup.
+    """
+    model = load_model()
+    print("[transcribe_lyrics] Serving jobs from stdin", flush=True)
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+            transcribe_lyrics(job["input"], job["output"], model=model,
+                              language=job.get("language"), beam_size=beam_size)
+            status = {"status": "ok", "output": job["output"]}
+        except SystemExit as e:
+            # Details were already printed as ERROR lines
+            status = {"status": "error", "error": f"job failed (exit code {e.code})"}
+        except Exception as e:
+            status = {"status": "error", "error": str(e)}
+        print(json.dumps(status), flush=True)
+
+
+def _socket_path(socket_path: str = None) -> str:
+    return (socket_path or os.environ.get(SOCKET_ENV)
+            or worker_socket.default_socket_path("transcribe_lyrics"))
+
+
+def listen(socket_path: str = None, beam_size: int = BEAM_SIZE) -> None:
+    """
+    Load the model once and transcribe requests sent by --client until killed.
+    Each request is an (audio_path, output_path, language) tuple; the reply
+    is ("ok", output_path) or ("error", message).
+    """
+    socket_path = _socket_path(socket_path)
+    model = load_model()
+
+    listener = worker_socket.listen(socket_path)
+    print(f"[transcribe_lyrics] Listening on {socket_path}", flush=True)
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, EOFError) as e:
+                print(f"[transcribe_lyrics] Rejected connection: {e}", file=sys.stderr)
+                continue
+            with conn:
+                try:
+                    audio_path, output_path, language = conn.recv()
+                    transcribe_lyrics(audio_path, output_path, model=model,
+                                      language=language, beam_size=beam_size)
+                    conn.send(("ok", output_path))
+                except (Exception, SystemExit) as e:
+                    print(f"[transcribe_lyrics] Request failed: {e}", file=sys.stderr)
+                    try:
+                        conn.send(("error", str(e)))
+                    except OSError:
+                        pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def client(socket_path: str, audio_path: str, output_path: str,
+           language: str = None, beam_size: int = BEAM_SIZE) -> None:
+    """Send one request to a --listen process, or transcribe in-process if none is up."""
+    socket_path = _socket_path(socket_path)
+    # The server may run in another working directory
+    request = (os.path.abspath(audio_path), os.path.abspath(output_path), language)
+    try:
+        conn = worker_socket.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"[transcribe_lyrics] No server on {socket_path}, transcribing in-process")
+        transcribe_lyrics(audio_path, output_path, language=language,
+                          beam_size=beam_size)
+        return
+    except AuthenticationError:
+        print(f"WARNING: server on {socket_path} rejected our key, transcribing in-process",
+              file=sys.stderr)
+        transcribe_lyrics(audio_path, output_path, language=language,
+                          beam_size=beam_size)
+        return
+
+    with conn:
+        conn.send(request)
+        status, detail = conn.recv()
+    if status != "ok":
+        print(f"ERROR: {detail}", file=sys.stderr)
         sys.exit(1)
+    print(f"[transcribe_lyrics] Saved to: {output_path}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Transcribe lyrics with word timestamps using faster-whisper.")
+    parser.add_argument("paths", nargs="*", metavar="ARG",
+                        help="<audio_wav> <output_json> [language]")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--batch", metavar="MANIFEST",
+                      help="Transcribe every <audio>\\t<output>[\\t<language>] line of MANIFEST")
+    mode.add_argument("--serve", action="store_true",
+                      help="Keep the model loaded and read JSON jobs from stdin")
+    mode.add_argument("--listen", action="store_true",
+                      help="Keep the model loaded and serve requests on --socket")
+    mode.add_argument("--client", action="store_true",
+                      help="Send the request to a running --listen process")
+    parser.add_argument("--beam", type=int, default=BEAM_SIZE, metavar="N",
+                        help=f"beam size; 1 = greedy (default: $WHISPER_BEAM_SIZE or {BEAM_SIZE})")
+    parser.add_argument("--socket", default=None,
+                        help=f"Unix socket path (default: ${SOCKET_ENV}, else "
+                             f"transcribe_lyrics.sock in $XDG_RUNTIME_DIR or a private temp dir)")
+    args = parser.parse_args()
 
-    transcribe_lyrics(sys.argv[1], sys.argv[2])
+    if (args.serve or args.listen or args.batch) and args.paths:
+        parser.error("--batch/--serve/--listen take no positional arguments")
+    if args.batch:
+        sys.exit(1 if transcribe_manifest(args.batch, args.beam) else 0)
+    elif args.serve:
+        serve(args.beam)
+    elif args.listen:
+        listen(args.socket, args.beam)
+    elif len(args.paths) not in (2, 3):
+        parser.error("expected <audio_wav> <output_json> [language]")
+    elif args.client:
+        client(args.socket, *args.paths[:2],
+               language=args.paths[2] if len(args.paths) == 3 else None,
+               beam_size=args.beam)
+    else:
+        transcribe_lyrics(*args.paths[:2],
+                          language=args.paths[2] if len(args.paths) == 3 else None,
+                          beam_size=args.beam)
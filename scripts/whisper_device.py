@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Shared device selection for the faster-whisper scripts.
+
+pick_device() chooses the WhisperModel device and compute type (CUDA when
+available, else an int8 or float32 CPU path depending on the CPU's int8
+support; WHISPER_DEVICE and WHISPER_COMPUTE_TYPE override it),
+cpu_threads() sizes the CPU thread pools to the cores this process may
+actually use, and pin_thread_pools() applies that size to OpenMP and BLAS.
+"""
+
+import math
+import os
+
+
+def cpu_info() -> tuple:
+    """
+    Return (flags, physical_cores) from /proc/cpuinfo: the CPU feature flag
+    set and the number of distinct physical cores (SMT siblings counted
+    once).  Returns (None, None) where /proc/cpuinfo is unavailable.
+    """
+    try:
+        with open("/proc/cpuinfo") as f:
+            text = f.read()
+    except OSError:
+        return None, None
+
+    flags = set()
+    cores = set()
+    physical_id = core_id = None
+    for line in text.splitlines():
+        key, _, value = line.partition(":")
+        key = key.strip()
+        if key == "flags" and not flags:
+            flags = set(value.split())
+        elif key == "physical id":
+            physical_id = value.strip()
+        elif key == "core id":
+            core_id = value.strip()
+        elif not line.strip():
+            if core_id is not None:
+                cores.add((physical_id, core_id))
+            physical_id = core_id = None
+    if core_id is not None:
+        cores.add((physical_id, core_id))
+    return flags, len(cores) or None
+
+
+def cpu_compute_type() -> str:
+    """
+    int8 where CTranslate2's int8 GEMMs are fast (x86 with AVX512-VNNI,
+    AVX-VNNI or AMX, and ARM / Apple Silicon); float32 on older x86 CPUs,
+    where int8 can be slower than float32.
+    """
+    import platform
+
+    if platform.machine().lower() not in ("x86_64", "amd64", "i386", "i686"):
+        return "int8"
+    flags, _ = cpu_info()
+    if flags is None:
+        return "int8"
+    if flags & {"avx512_vnni", "avx_vnni", "amx_int8"}:
+        return "int8"
+    return "float32"
+
+
+def pick_device() -> tuple:
+    """
+    Return (device, compute_type) for WhisperModel: CUDA with int8 weights
+    and float16 activations when a GPU is visible (plain float16 on GPUs
+    without int8 kernels), otherwise CPU with cpu_compute_type().
+    WHISPER_DEVICE and WHISPER_COMPUTE_TYPE override the automatic choice.
+    """
+    device, compute_type = "cpu", None
+    try:
+        import ctranslate2
+        if ctranslate2.get_cuda_device_count() > 0:
+            supported = ctranslate2.get_supported_compute_types("cuda")
+            for candidate in ("int8_float16", "float16"):
+                if candidate in supported:
+                    device, compute_type = "cuda", candidate
+                    break
+    except Exception:
+        pass
+
+    forced_device = os.environ.get("WHISPER_DEVICE")
+    if forced_device and forced_device != device:
+        device = forced_device
+        compute_type = "float16" if device == "cuda" else None
+    compute_type = os.environ.get("WHISPER_COMPUTE_TYPE") or compute_type
+    return device, compute_type or cpu_compute_type()
+
+
+def cpu_quota() -> float:
+    """
+    Return the cgroup CPU quota in cores (e.g. 2.0 for docker --cpus=2), or
+    None when unlimited or unknown.  Reads cgroup v2 cpu.max, else the v1
+    cpu.cfs_quota_us / cpu.cfs_period_us pair.
+    """
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota == "max":
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+    except (OSError, ValueError):
+        return None
+    return quota / period if quota > 0 and period > 0 else None
+
+
+def cpu_threads(spare_threads: int = 0) -> int:
+    """
+    Return the CPU thread count for WhisperModel: one per physical core
+    (SMT siblings only contend for the same GEMM units; CTranslate2 would
+    default to 4), capped at the CPUs in this process's affinity mask and
+    the cgroup quota (so a container on a large host doesn't oversubscribe
+    its share), minus spare_threads left free for other work.
+    """
+    _flags, cores = cpu_info()
+    limit = cores or os.cpu_count() or 1
+    if hasattr(os, "sched_getaffinity"):
+        limit = min(limit, len(os.sched_getaffinity(0)))
+    quota = cpu_quota()
+    if quota is not None:
+        limit = min(limit, max(1, math.ceil(quota)))
+    return max(1, limit - spare_threads)
+
+
+def pin_thread_pools(threads: int) -> None:
+    """
+    Size the OpenMP and BLAS thread pools to `threads` unless the environment
+    already does.  The libraries read these when they are loaded, so call
+    this before faster_whisper pulls in ctranslate2 and numpy.
+    """
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ.setdefault(var, str(threads))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Shared unix-socket transport for the long-running model workers
+(align_lyrics.py --serve, transcribe_lyrics.py --listen).
+
+Requests and replies are pickled, so both ends must trust each other:
+sockets live in a per-user directory ($XDG_RUNTIME_DIR, else a 0700
+directory under the system temp dir) and every connection is authenticated
+with a shared key.  The key is $VIDEO_EDITOR_WORKER_KEY if set, else a
+random key kept in that private directory (created 0600 on first use).
+Authentication happens before anything is unpickled, in both directions.
+"""
+
+import os
+import stat
+import sys
+import tempfile
+
+KEY_FILE = "worker.key"
+
+
+def private_dir() -> str:
+    """
+    Return a directory only the current user can access: $XDG_RUNTIME_DIR,
+    else <tmp>/video-editor-<uid> (created 0700).  Exits if the latter
+    exists but belongs to someone else or is accessible to others.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return runtime_dir
+
+    path = os.path.join(tempfile.gettempdir(), f"video-editor-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        print(f"ERROR: {path} is not a private directory of this user; "
+              f"remove it or set XDG_RUNTIME_DIR", file=sys.stderr)
+        sys.exit(1)
+    return path
+
+
+def default_socket_path(name: str) -> str:
+    """Default socket path for worker `name` in the private directory."""
+    return os.path.join(private_dir(), f"{name}.sock")
+
+
+def authkey() -> bytes:
+    """Return the shared connection key, creating the key file if needed."""
+    key = os.environ.get("VIDEO_EDITOR_WORKER_KEY")
+    if key:
+        return key.encode()
+
+    key_path = os.path.join(private_dir(), KEY_FILE)
+    if not os.path.exists(key_path):
+        # Write to a temp file and link it into place, so a worker and a
+        # client starting together never read a half-written key
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(key_path))
+        try:
+            with open(fd, "wb") as f:
+                f.write(os.urandom(32))
+            try:
+                os.link(tmp_path, key_path)
+            except FileExistsError:
+                pass
+        finally:
+            os.remove(tmp_path)
+    with open(key_path, "rb") as f:
+        return f.read()
+
+
+def listen(socket_path: str):
+    """
+    Bind an authenticated multiprocessing Listener on socket_path, replacing
+    a stale socket file.  The socket is created 0600 from the start.
+    """
+    from multiprocessing.connection import Listener
+
+    key = authkey()
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    old_umask = os.umask(0o177)
+    try:
+        return Listener(socket_path, family="AF_UNIX", authkey=key)
+    finally:
+        os.umask(old_umask)
+
+
+def connect(socket_path: str):
+    """
+    Connect to a worker on socket_path.  Raises FileNotFoundError /
+    ConnectionRefusedError when no worker is listening and
+    multiprocessing.AuthenticationError when the peer has another key.
+    """
+    from multiprocessing.connection import Client
+
+    return Client(socket_path, family="AF_UNIX", authkey=authkey())